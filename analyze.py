@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+"""
+Offline analytics over recorded sessions (archives written with --archive).
+Frames are decoded in large chunks per CAN id with NumPy using the signal
+definitions of signals.py, so memory stays bounded by the chunk size.
+Segment files are independent work units and can be processed in parallel.
+Packages: numpy, and pandas + pyarrow for Parquet output.
+"""
+
+# pylint: disable=C0103
+
+import argparse
+import csv
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
+from archive import ArchiveReader
+import signals as sig
+
+CHUNK = 200000  # frames decoded at once
+MAX_GAP = 5.0  # s, longer gaps between state frames are not accounted
+
+STATE_SIGNALS = ['gsc_state', 'msc_state']
+TEL_BINS = 50
+TEL_MAX = 500.0  # N.m
+RPM_BINS = 60
+RPM_MAX = 1200.0
+HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+
+
+class Stats:
+    """Mergeable aggregates of one session or part of it."""
+
+    def __init__(self):
+        self.sig = {}  # name: [count, min, max, sum]
+        self.states = {name: np.zeros(len(sig.RUNNING_STATES) + 1) for name in STATE_SIGNALS}
+        self.tel_rpm = np.zeros((RPM_BINS, TEL_BINS), dtype=np.int64)
+        self.frames = 0
+        self.skipped = 0  # frames with malformed data, e.g. line noise
+
+    def add_signal(self, name: str, x: np.ndarray) -> None:
+        """Accumulate values x of signal name."""
+        if len(x) == 0:
+            return
+        a = self.sig.get(name)
+        if a is None:
+            self.sig[name] = [len(x), x.min(), x.max(), x.sum()]
+        else:
+            a[0] += len(x)
+            a[1] = min(a[1], x.min())
+            a[2] = max(a[2], x.max())
+            a[3] += x.sum()
+
+    def merge(self, other) -> None:
+        """Merge aggregates of other into self."""
+        for name, (n, lo, hi, tot) in other.sig.items():
+            a = self.sig.get(name)
+            if a is None:
+                self.sig[name] = [n, lo, hi, tot]
+            else:
+                a[0] += n
+                a[1] = min(a[1], lo)
+                a[2] = max(a[2], hi)
+                a[3] += tot
+        for name in STATE_SIGNALS:
+            self.states[name] += other.states[name]
+        self.tel_rpm += other.tel_rpm
+        self.frames += other.frames
+        self.skipped += other.skipped
+
+
+def decode_chunk(can_id: int, data: list) -> dict:
+    """Return {name: array} decoding hex strings data of frames can_id."""
+    size = len(data[0]) // 2
+    raw = np.frombuffer(bytes.fromhex(''.join(data)), dtype=np.uint8).reshape(-1, size)
+    values = {}
+    for fld in sig.SIGNALS[can_id]:
+        n = sig.field_size(fld)
+        if fld.offset + n > size:
+            continue
+        col = np.ascontiguousarray(raw[:, fld.offset:fld.offset + n])
+        x = col.view('>' + fld.fmt).ravel().astype(np.int64)
+        if fld.shift:
+            x >>= fld.shift
+        if fld.mask is not None:
+            x &= fld.mask
+        values[fld.name] = x * fld.scale
+    return values
+
+
+class Session:
+    """Process the frames of one segment, carrying state between chunks."""
+
+    def __init__(self):
+        self.stats = Stats()
+        self.last_state = {name: None for name in STATE_SIGNALS}  # (ts, state)
+        self.last_rpm = None
+
+    def add_states(self, name: str, ts: np.ndarray, state: np.ndarray) -> None:
+        """Accumulate time spent in each state."""
+        if self.last_state[name] is not None:
+            ts = np.concatenate(([self.last_state[name][0]], ts))
+            state = np.concatenate(([self.last_state[name][1]], state))
+        dt = np.diff(ts) * 1e-9
+        st = state[:-1].astype(np.int64)
+        ok = dt <= MAX_GAP
+        st = np.where(st < len(sig.RUNNING_STATES), st, len(sig.RUNNING_STATES))
+        self.stats.states[name] += np.bincount(st[ok], weights=dt[ok], minlength=len(sig.RUNNING_STATES) + 1)
+        self.last_state[name] = (ts[-1], state[-1])
+
+    def add_tel_rpm(self, ts_tel, tel, ts_rpm, rpm) -> None:
+        """Histogram of msc_tel against the latest msc_rpm received before it."""
+        if self.last_rpm is not None:
+            ts_rpm = np.concatenate(([self.last_rpm[0]], ts_rpm))
+            rpm = np.concatenate(([self.last_rpm[1]], rpm))
+        if len(rpm) == 0:
+            return
+        i = np.searchsorted(ts_rpm, ts_tel, side='right') - 1
+        ok = i >= 0
+        h, _, _ = np.histogram2d(rpm[i[ok]], tel[ok], bins=(RPM_BINS, TEL_BINS),
+                                 range=((-RPM_MAX, RPM_MAX), (0.0, TEL_MAX)))
+        self.stats.tel_rpm += h.astype(np.int64)
+        self.last_rpm = (ts_rpm[-1], rpm[-1])
+
+    def chunk(self, frames: list) -> None:
+        """Decode and aggregate a chunk of (ts, line) frames."""
+        groups = {}  # (can_id, size): ([ts], [data])
+        for ts, line in frames:
+            parsed = sig.parse_twai(line.decode('utf-8', 'replace').split())
+            if parsed is None or parsed[0] not in sig.SIGNALS:
+                continue
+            if len(parsed[1]) % 2 or not HEX_DIGITS.issuperset(parsed[1]):
+                self.stats.skipped += 1
+                continue
+            g = groups.setdefault((parsed[0], len(parsed[1])), ([], []))
+            g[0].append(ts)
+            g[1].append(parsed[1])
+        self.stats.frames += len(frames)
+        decoded = {}  # name: (ts, values)
+        for (can_id, _size), (ts, data) in groups.items():
+            ts = np.array(ts, dtype=np.int64)
+            for name, x in decode_chunk(can_id, data).items():
+                if name in decoded:
+                    # same id seen with different lengths
+                    t0, x0 = decoded[name]
+                    t = np.concatenate((t0, ts))
+                    order = np.argsort(t, kind='stable')
+                    decoded[name] = (t[order], np.concatenate((x0, x))[order])
+                else:
+                    decoded[name] = (ts, x)
+        for name, (ts, x) in decoded.items():
+            self.stats.add_signal(name, x)
+        for name in STATE_SIGNALS:
+            if name in decoded:
+                self.add_states(name, *decoded[name])
+        if 'msc_tel' in decoded:
+            ts_rpm, rpm = decoded.get('msc_rpm', (np.zeros(0, np.int64), np.zeros(0)))
+            self.add_tel_rpm(*decoded['msc_tel'], ts_rpm, rpm)
+        elif 'msc_rpm' in decoded:
+            self.last_rpm = (decoded['msc_rpm'][0][-1], decoded['msc_rpm'][1][-1])
+
+
+def process_segment(path: Path) -> Stats:
+    """Return aggregates of segment file path."""
+    session = Session()
+    frames = []
+    with open(path, 'rb') as f:
+        for _first, _last, offset, size, _count in ArchiveReader.read_index(path):
+            frames.extend(ArchiveReader.read_block(f, offset, size))
+            if len(frames) >= CHUNK:
+                session.chunk(frames)
+                frames = []
+    if frames:
+        session.chunk(frames)
+    return session.stats
+
+
+def write_table(path: Path, header: list, rows: list, fmt: str) -> None:
+    """Write rows as CSV or Parquet file path (suffix added)."""
+    if fmt == 'parquet':
+        try:
+            import pandas as pd  # pylint: disable=C0415
+        except ImportError:
+            print('ERROR: Parquet output needs pandas and pyarrow')
+            sys.exit(1)
+        pd.DataFrame(rows, columns=header).to_parquet(path.with_suffix('.parquet'))
+        return
+    with open(path.with_suffix('.csv'), 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(rows)
+
+
+def report(stats: Stats, out: Path, fmt: str) -> None:
+    """Write statistics tables into directory out."""
+    out.mkdir(parents=True, exist_ok=True)
+    rows = [[name, n, lo, hi, tot / n] for name, (n, lo, hi, tot) in sorted(stats.sig.items())]
+    write_table(out / 'signals', ['signal', 'count', 'min', 'max', 'mean'], rows, fmt)
+    rows = []
+    for name in STATE_SIGNALS:
+        for i, t in enumerate(stats.states[name]):
+            state = sig.RUNNING_STATES[i] if i < len(sig.RUNNING_STATES) else '???'
+            rows.append([name, state, t])
+    write_table(out / 'states', ['converter', 'state', 'seconds'], rows, fmt)
+    rpm_edges = np.linspace(-RPM_MAX, RPM_MAX, RPM_BINS + 1)
+    tel_edges = np.linspace(0.0, TEL_MAX, TEL_BINS + 1)
+    rows = [[rpm_edges[i], rpm_edges[i + 1], tel_edges[j], tel_edges[j + 1], int(stats.tel_rpm[i, j])]
+            for i in range(RPM_BINS) for j in range(TEL_BINS) if stats.tel_rpm[i, j]]
+    write_table(out / 'tel_rpm', ['rpm_lo', 'rpm_hi', 'tel_lo', 'tel_hi', 'count'], rows, fmt)
+
+
+def main():
+    """Analyze archives given in command line."""
+    parser = argparse.ArgumentParser(description='Statistics of recorded sessions.')
+    parser.add_argument('paths', nargs='+', help='archive directories or segment files')
+    parser.add_argument('-o', '--output', default='report', help='output directory')
+    parser.add_argument('-f', '--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='parallel processes')
+    args = parser.parse_args()
+
+    segments = []
+    for p in map(Path, args.paths):
+        segments.extend(ArchiveReader(p).segments() if p.is_dir() else [p])
+    stats = Stats()
+    if args.jobs > 1:
+        with Pool(args.jobs) as pool:
+            for s in pool.imap_unordered(process_segment, segments):
+                stats.merge(s)
+    else:
+        for p in segments:
+            stats.merge(process_segment(p))
+    print(f'INFO: {stats.frames} frames in {len(segments)} segments')
+    if stats.skipped:
+        print(f'WARN: {stats.skipped} frames with malformed data skipped')
+    report(stats, Path(args.output), args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+"""
+Rotating compressed archive of received frames.
+Frames are grouped in zlib compressed blocks inside time bounded segment
+files. Each segment has a sparse index with one entry per block, so a time
+window query decompresses only the blocks it overlaps.
+
+Segment seg-<start_ns>.abv: concatenated compressed blocks, each holding
+records <QH ts_ns, length> + line bytes.
+Index seg-<start_ns>.idx: <QQQII first_ts, last_ts, offset, size, count>
+per block.
+"""
+
+# pylint: disable=C0103
+
+import argparse
+import bisect
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+REC = struct.Struct('<QH')
+IDX = struct.Struct('<QQQII')
+
+BLOCK_FRAMES = 2048  # frames per compressed block
+BLOCK_AGE = 2.0  # s, flush a block older than this even if not full
+SEGMENT_TIME = 600.0  # s per segment file
+MAX_BYTES = 20 * 2**30  # retention: total archive size
+MAX_AGE = 14 * 86400.0  # retention: s
+
+
+def segment_start(path: Path) -> int:
+    """Return start time in ns from segment path name."""
+    return int(path.stem.split('-')[1])
+
+
+def segment_size(path: Path) -> int:
+    """Return size in bytes of segment path and its index."""
+    idx = path.with_suffix('.idx')
+    return path.stat().st_size + (idx.stat().st_size if idx.exists() else 0)
+
+
+class ArchiveWriter:
+    """
+    Recording stage: write(line) is called for each frame.
+    A timer thread flushes a block older than BLOCK_AGE when frames stop
+    arriving, so a quiet link (e.g. after a trip) does not hold the last
+    frames in memory. Stop the writers before close().
+    """
+
+    def __init__(self, directory, segment_time=SEGMENT_TIME, max_bytes=MAX_BYTES,
+                 max_age=MAX_AGE, level=6):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.segment_time_ns = int(segment_time * 1e9)
+        self.max_bytes = max_bytes
+        self.max_age_ns = int(max_age * 1e9)
+        self.level = level
+        self.seg = None
+        self.idx = None
+        self.seg_start = 0
+        self.block = []
+        self.block_first = 0
+        self.block_last = 0
+        self.block_born = 0  # monotonic ns the current block was started
+        self.mut = Lock()
+        self.stop_evt = Event()
+        self.th = Thread(target=self.flush_thread, name='archive')
+        self.th.daemon = True
+        self.th.start()
+
+    def write(self, line: bytes, ts: int = 0) -> None:
+        """Append frame line received at wall clock ts (ns)."""
+        if ts == 0:
+            ts = time.time_ns()
+        with self.mut:
+            if self.seg is None or ts - self.seg_start >= self.segment_time_ns:
+                self.roll(ts)
+            if not self.block:
+                self.block_first = self.block_last = ts
+                self.block_born = time.monotonic_ns()
+            self.block.append(REC.pack(ts, len(line)) + line)
+            # gateway aligned stamps may be slightly out of order
+            self.block_first = min(self.block_first, ts)
+            self.block_last = max(self.block_last, ts)
+            if len(self.block) >= BLOCK_FRAMES or ts - self.block_first >= BLOCK_AGE * 1e9:
+                self.flush()
+
+    def flush_thread(self) -> None:
+        """Flush blocks older than BLOCK_AGE until closed."""
+        while not self.stop_evt.wait(BLOCK_AGE / 2):
+            with self.mut:
+                if self.block and time.monotonic_ns() - self.block_born >= BLOCK_AGE * 1e9:
+                    self.flush()
+
+    def flush(self) -> None:
+        """Compress and write the current block and its index entry."""
+        if not self.block or self.seg is None:
+            return
+        data = zlib.compress(b''.join(self.block), self.level)
+        offset = self.seg.tell()
+        self.seg.write(data)
+        self.seg.flush()
+        self.idx.write(IDX.pack(self.block_first, self.block_last, offset, len(data), len(self.block)))
+        self.idx.flush()
+        self.block = []
+
+    def roll(self, ts: int) -> None:
+        """Close current segment, start a new one at ts and apply retention."""
+        self.end_segment()
+        self.seg_start = ts
+        self.seg = open(self.dir / f'seg-{ts}.abv', 'wb')
+        self.idx = open(self.dir / f'seg-{ts}.idx', 'wb')
+        self.retain(ts)
+
+    def retain(self, now: int) -> None:
+        """Remove oldest segments beyond age or size limits."""
+        segs = sorted(self.dir.glob('seg-*.abv'), key=segment_start)
+        sizes = [segment_size(p) for p in segs]
+        total = sum(sizes)
+        # never remove the segment being written (last one)
+        for p, size in zip(segs[:-1], sizes[:-1]):
+            if total <= self.max_bytes and now - segment_start(p) <= self.max_age_ns:
+                break
+            print(f'INFO: archive: removing {p.name}')
+            p.unlink()
+            p.with_suffix('.idx').unlink(missing_ok=True)
+            total -= size
+
+    def end_segment(self) -> None:
+        """Flush and close current segment."""
+        if self.seg is not None:
+            self.flush()
+            self.seg.close()
+            self.idx.close()
+            self.seg = None
+            self.idx = None
+
+    def close(self) -> None:
+        """Stop the flush timer, flush and close current segment."""
+        self.stop_evt.set()
+        self.th.join()
+        with self.mut:
+            self.end_segment()
+
+
+class ArchiveReader:
+    """Time window queries over an archive directory."""
+
+    def __init__(self, directory):
+        self.dir = Path(directory)
+
+    def segments(self) -> list:
+        """Return segment paths sorted by start time."""
+        return sorted(self.dir.glob('seg-*.abv'), key=segment_start)
+
+    @staticmethod
+    def read_index(path: Path) -> list:
+        """Return list of index entries of segment path."""
+        data = path.with_suffix('.idx').read_bytes()
+        n = len(data) // IDX.size  # ignore a partially written entry
+        return [IDX.unpack_from(data, i * IDX.size) for i in range(n)]
+
+    @staticmethod
+    def read_block(f, offset: int, size: int):
+        """Yield (ts, line) of the block at offset in open segment file f."""
+        f.seek(offset)
+        data = zlib.decompress(f.read(size))
+        pos = 0
+        while pos < len(data):
+            ts, length = REC.unpack_from(data, pos)
+            pos += REC.size
+            yield ts, data[pos:pos + length]
+            pos += length
+
+    def query(self, t0: int, t1: int):
+        """Yield (ts, line) of frames with t0 <= ts <= t1 (wall clock ns)."""
+        segs = self.segments()
+        starts = [segment_start(p) for p in segs]
+        # last segment starting before t0 may still hold frames after t0
+        first = max(bisect.bisect_right(starts, t0) - 1, 0)
+        for p, start in zip(segs[first:], starts[first:]):
+            if start > t1:
+                break
+            index = self.read_index(p)
+            last_ts = [e[1] for e in index]
+            with open(p, 'rb') as f:
+                for first_ts, _last, offset, size, _count in index[bisect.bisect_left(last_ts, t0):]:
+                    if first_ts > t1:
+                        break
+                    for ts, line in self.read_block(f, offset, size):
+                        if t0 <= ts <= t1:
+                            yield ts, line
+
+    def window(self, t_event: int, before=30.0, after=0.0):
+        """Yield frames from before s until after s around t_event (ns)."""
+        return self.query(t_event - int(before * 1e9), t_event + int(after * 1e9))
+
+
+def parse_time(s: str) -> int:
+    """Parse ISO date and time, or a time of today, into ns."""
+    try:
+        t = datetime.fromisoformat(s)
+    except ValueError:
+        t = datetime.combine(datetime.now().date(), datetime.strptime(s, '%H:%M:%S' if s.count(':') == 2 else '%H:%M').time())
+    return int(t.timestamp() * 1e9)
+
+
+def main():
+    """Print frames of a time window of an archive."""
+    parser = argparse.ArgumentParser(description='Query a frame archive.')
+    parser.add_argument('directory')
+    parser.add_argument('--at', required=True, help='event time, ISO or HH:MM[:SS] of today')
+    parser.add_argument('--before', type=float, default=30.0, help='seconds before event')
+    parser.add_argument('--after', type=float, default=0.0, help='seconds after event')
+    args = parser.parse_args()
+    for ts, line in ArchiveReader(args.directory).window(parse_time(args.at), args.before, args.after):
+        t = datetime.fromtimestamp(ts * 1e-9).isoformat(timespec='microseconds')
+        sys.stdout.write(f'{t} {line.decode("utf-8", "replace")}\n')
+
+
+if __name__ == '__main__':
+    main()
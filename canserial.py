@@ -1,9 +1,12 @@
-from threading import Lock
+from threading import Lock, Thread
 from pathlib import Path
 import serial
 import time
 from termcolor import colored
 import ctypes
+from cmdpipe import CommandPipe
+import linkprobe
+from clocksync import ClockSync
 
 #used for usleep
 libc = ctypes.CDLL('libc.so.6')
@@ -26,6 +29,13 @@ class CanSerial:
         self.dev_list = []
         self.debug = False
         self.interpreter = _interpreter
+        self.profiler = None  # set to a profiler.Profiler to time stages
+        self.recorder = None  # set to an archive.ArchiveWriter to keep frames
+        self.pipe = None  # CommandPipe when gateway acknowledges commands
+        self.max_baud = 0  # negotiate baud rate up to this when opening
+        self.throughput = 0.0  # B/s measured by negotiation
+        self.clock = ClockSync()
+        self.running = True  # cleared to stop read_thread
 
     def create_list(self):
         """Return a list of serial devices available."""
@@ -44,11 +54,25 @@ class CanSerial:
             if Path(filename).exists():
                 self.dev_list.append(filename)
 
+    def enable_ack(self, window: int):
+        """Send commands with sequence numbers, up to window unacknowledged."""
+        self.pipe = CommandPipe(self.write_raw, window)
+
     def write(self, s: str):
         """Safe wrapper to serial write function."""
         print(s)
         if self.debug:
             print(s)
+        if self.pipe is not None:
+            if self.ser.isOpen():
+                self.pipe.submit(s)
+            else:
+                print('ERROR: serial is not openned')
+            return
+        self.write_raw(s)
+
+    def write_raw(self, s: str):
+        """Write s to serial, without acknowledge protocol."""
         with self.mut:
             if self.ser.isOpen():
                 self.ser.write(s.encode('ascii'))
@@ -56,6 +80,15 @@ class CanSerial:
             else:
                 print('ERROR: serial is not openned')
 
+    def is_open(self) -> bool:
+        """Return True if serial is open."""
+        return self.ser.isOpen()
+
+    @property
+    def baudrate(self) -> int:
+        """Current baud rate."""
+        return self.ser.baudrate
+
     def read(self):
         """Safe wrapper to serial read function."""
         with self.mut_rd:
@@ -63,6 +96,27 @@ class CanSerial:
                 return self.ser.readline()
             return ''
 
+    def read_timed(self, prof):
+        """
+        Like read(), but account the wait for the first byte of the line apart
+        from reading the line, so inter frame gaps do not show as readline cost.
+        """
+        with self.mut_rd:
+            if not self.ser.isOpen():
+                return b''
+            t0 = time.perf_counter_ns()
+            head = b''
+            if not self.ser.in_waiting:
+                head = self.ser.read(1)
+                if head in (b'', b'\n'):
+                    prof.add('wait', time.perf_counter_ns() - t0)
+                    return head
+            t1 = time.perf_counter_ns()
+            ll = head + self.ser.readline()
+            prof.add('wait', t1 - t0)
+            prof.add('readline', time.perf_counter_ns() - t1)
+            return ll
+
     def open(self, name_):
         """
         Safe wrapper to serial open function, that verify other files.
@@ -74,7 +128,7 @@ class CanSerial:
         try:
             if self.debug:
                 print(f'INFO: trying to open serial {name_}')
-            self.ser = serial.Serial(name_, 115200, timeout=1)
+            self.ser = serial.Serial(name_, linkprobe.BAUD, timeout=1)
         except serial.SerialException:
             self.ser.close()
             print(f'ERRO: opening serial {name_}')
@@ -82,6 +136,31 @@ class CanSerial:
         self.ser.flush()
         self.ser.dtr = False
         self.ser.rts = False
+        if self.max_baud > linkprobe.BAUD and self.ser.isOpen():
+            self.negotiate()
+
+    def negotiate(self):
+        """Raise baud rate as far as the gateway and the link allow."""
+        with self.mut, self.mut_rd:
+            try:
+                baud, self.throughput = linkprobe.negotiate(self.ser, self.max_baud)
+            except serial.SerialException as e:
+                print(f'ERROR: negotiating baud rate: {e}')
+                return
+        print(f'INFO: serial {self.name} at {baud} baud: {linkprobe.capacity(self.throughput)}')
+
+    def restore_baud(self):
+        """Bring the gateway back to the default rate, the one open() starts at."""
+        with self.mut, self.mut_rd:
+            if not self.ser.isOpen() or self.ser.baudrate == linkprobe.BAUD:
+                return
+            try:
+                if linkprobe.try_rate(self.ser, linkprobe.BAUD) > 0:
+                    self.throughput = 0.0
+                    return
+            except serial.SerialException as e:
+                print(f'ERROR: restoring baud rate: {e}')
+        print(f'WARN: gateway left at {self.ser.baudrate} baud, reset it before connecting again')
 
     def reset(self):
         """Reset ESP32 with Reset pin connected to DTR."""
@@ -94,12 +173,33 @@ class CanSerial:
         libc.usleep(50)
         self.ser.dtr = True
         self.ser.rts = True
+        # the gateway restarts at the default rate
+        with self.mut, self.mut_rd:
+            if self.ser.isOpen() and self.ser.baudrate != linkprobe.BAUD:
+                self.ser.baudrate = linkprobe.BAUD
+                self.throughput = 0.0
+        if self.max_baud > linkprobe.BAUD and self.ser.isOpen():
+            th = Thread(target=self.renegotiate, name='negotiate')
+            th.daemon = True
+            th.start()
+
+    def renegotiate(self):
+        """Negotiate baud rate again once the gateway restarted."""
+        time.sleep(linkprobe.BOOT_TIME)
+        if self.ser.isOpen():
+            self.negotiate()
 
     def disconnect(self):
         """Properly disconect serial flushing data."""
         # global ser_name
         if self.debug:
             print('INFO: flushing serial')
+        if self.pipe is not None:
+            print('INFO: commands: ' + self.pipe.report())
+            self.pipe.clear()
+        print('INFO: ' + self.clock.report())
+        self.clock.reset()
+        self.restore_baud()
         with self.mut:
             # with self.mut_rd:
             if self.ser.isOpen():
@@ -111,8 +211,14 @@ class CanSerial:
 
     def interpret(self):
         """Interpret commands from serial device."""
-        while True:
-            ll = self.read().strip()
+        prof = self.profiler
+        while self.running:
+            if prof is not None:
+                ll = self.read_timed(prof).strip()
+                t1 = time.perf_counter_ns()
+            else:
+                ll = self.read().strip()
+            ts = rx_ts = time.monotonic_ns()
             if len(ll) < 1:
                 break
             try:
@@ -125,16 +231,30 @@ class CanSerial:
                 print(colored("LINE: ", "blue") + ll.decode('utf-8'))
             except UnicodeDecodeError:
                 lst = []
-            if len(lst) > 0:
-                self.interpreter(lst)
-
+            if prof is not None:
+                prof.add('decode', time.perf_counter_ns() - t1)
+            if len(lst) > 1 and lst[-1].startswith('@'):
+                # gateway tick: place frame on the gateway time base
+                try:
+                    ts = self.clock.add(int(lst[-1][1:]), ts)
+                except ValueError:
+                    pass
+                lst = lst[:-1]
+            if self.recorder is not None:
+                # archive on the wall clock, at the reception (or gateway aligned) time;
+                # the raw line keeps the gateway tick
+                self.recorder.write(ll, ts + time.time_ns() - time.monotonic_ns())
+            if len(lst) > 0 and lst[0] in ('ack', 'nak') and self.pipe is not None:
+                self.pipe.on_ack(lst)
+            elif len(lst) > 0:
+                self.interpreter(lst, ts, rx_ts)
 
     def read_thread(self):
         """Read serial and calls interpret function."""
         state = False
         # l = b''
         print('INFO: read_thread: waiting for serial')
-        while True:
+        while self.running:
             if self.ser.isOpen():
                 self.interpret()
             else:
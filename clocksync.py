@@ -0,0 +1,96 @@
+"""
+Alignment of the gateway clock to the host monotonic clock.
+A gateway firmware may append its microsecond tick counter (32 bit,
+wrapping, decimal) to each line as a last token '@<tick>'. Host stamps are
+delayed by USB and buffering by a variable amount, never advanced, so in
+each block the frame with the smallest host - gateway difference is the
+least delayed one. A line fitted over recent minima gives offset and drift.
+"""
+
+# pylint: disable=C0103
+
+from collections import deque
+
+TICK_WRAP = 1 << 32  # gateway ticks are 32 bit microseconds
+BLOCK = 1_000_000_000  # ns of gateway time per minimum
+HISTORY = 120  # minima in the fit, 2 minutes
+RESYNC = 100_000_000  # ns of misfit that means the gateway restarted
+RESYNC_FRAMES = 5  # consecutive late frames that mean a jump, not a delay
+
+
+class ClockSync:
+    """Estimate host_ns = tick_ns + offset + drift * (tick_ns - ref)."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all samples."""
+        self.last_tick = None
+        self.high = 0  # wrapped part of ticks, in us
+        self.block_start = None
+        self.block_min = None  # (host - tick, tick) with smallest difference of block
+        self.points = deque(maxlen=HISTORY)
+        self.offset = None
+        self.drift = 0.0
+        self.ref = 0
+        self.late = 0  # consecutive frames more than RESYNC late
+
+    def unwrap(self, tick: int) -> int:
+        """Return gateway time in ns of 32 bit tick in us."""
+        if self.last_tick is not None and tick < self.last_tick:
+            self.high += TICK_WRAP
+        self.last_tick = tick
+        return (self.high + tick) * 1000
+
+    def to_host(self, tick_ns: int) -> int:
+        """Return host monotonic ns of gateway time tick_ns."""
+        return tick_ns + int(self.offset + self.drift * (tick_ns - self.ref))
+
+    def fit(self) -> None:
+        """Least squares line over the block minima."""
+        if len(self.points) < 2:
+            self.offset, self.ref = self.points[-1]
+            self.drift = 0.0
+            return
+        ref = self.points[0][1]
+        n = len(self.points)
+        mx = sum(t - ref for _, t in self.points) / n
+        my = sum(o for o, _ in self.points) / n
+        sxx = sum((t - ref - mx) ** 2 for _, t in self.points)
+        sxy = sum((t - ref - mx) * (o - my) for o, t in self.points)
+        self.drift = sxy / sxx if sxx > 0 else 0.0
+        self.ref = ref
+        self.offset = my - self.drift * mx
+
+    def add(self, tick: int, host_ns: int) -> int:
+        """Add a frame with gateway tick received at host_ns; return its aligned host ns."""
+        tick_ns = self.unwrap(tick)
+        if self.offset is not None:
+            # a frame early by more than RESYNC is a jump, host stamps are
+            # never advanced; a late one may just have been held in buffers
+            misfit = host_ns - self.to_host(tick_ns)
+            self.late = self.late + 1 if misfit > RESYNC else 0
+            if misfit < -RESYNC or self.late >= RESYNC_FRAMES:
+                print('WARN: gateway clock jumped, resynchronizing')
+                self.reset()
+                tick_ns = self.unwrap(tick)
+        diff = host_ns - tick_ns
+        if self.block_start is None:
+            self.block_start = tick_ns
+        if self.block_min is None or diff < self.block_min[0]:
+            self.block_min = (diff, tick_ns)
+        if tick_ns - self.block_start >= BLOCK or self.offset is None:
+            self.points.append(self.block_min)
+            self.fit()
+            if tick_ns - self.block_start >= BLOCK:
+                self.block_start = tick_ns
+                self.block_min = None
+        return self.to_host(tick_ns)
+
+    def report(self) -> str:
+        """Return offset and drift as text."""
+        if self.offset is None:
+            return 'no gateway clock'
+        return 'gateway clock offset {:.3f}s drift {:.1f}ppm over {} blocks'.format(
+            self.offset * 1e-9, self.drift * 1e6, len(self.points))
@@ -0,0 +1,152 @@
+"""
+Pipelined command transmission with gateway acknowledgements.
+In this optional protocol mode every command is sent as
+
+    @<seq> <command>
+
+with seq a 16 bit hexadecimal sequence number, and the gateway answers
+'ack <seq>' once the command was accepted (or 'nak <seq>' if rejected).
+At most `window` commands are in flight, so the link is kept busy without
+overrunning the gateway input buffer; unacknowledged commands are resent
+after a timeout.
+"""
+
+# pylint: disable=C0103
+
+import time
+from collections import deque
+from threading import Condition, Thread
+import twai_ids as ids
+from commands import INV_TWAI_ID
+
+WINDOW = 4  # commands in flight
+ACK_TIMEOUT = 0.25  # s
+RETRIES = 3
+
+# Setpoint writes: a newer one replaces an older one still unacknowledged.
+# The Tupã pair is keyed without its on/off flag, so 'inv 0' supersedes
+# 'inv 1'. Requests (e.g. DATA_REQ bitmasks) are never superseded.
+SETPOINT_KEYS = {
+    'send {:04x}'.format(ids.MSCID_CURR_REF),
+    'send {:04x}'.format(ids.GSCID_MAX_POWER),
+    'send {:08x}'.format(INV_TWAI_ID),
+    'inv',
+}
+
+
+def command_key(cmd: str):
+    """Return what setpoint cmd sets, e.g. 'send 0205', or None if cmd is not a setpoint."""
+    lst = cmd.split()
+    key = 'inv' if lst[:1] == ['inv'] else ' '.join(lst[:2])
+    return key if key in SETPOINT_KEYS else None
+
+
+class CommandPipe:
+    """Window of commands in flight, fed by submit() and drained by acks."""
+
+    def __init__(self, write_raw, window=WINDOW, timeout=ACK_TIMEOUT, retries=RETRIES):
+        self.write_raw = write_raw
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.cond = Condition()
+        self.pending = deque()
+        self.inflight = {}  # seq: [cmd, t_sent (monotonic s), tries]
+        self.latest = {}  # setpoint key: seq of latest command submitted
+        self.seq = 0
+        self.n_sent = 0
+        self.n_acked = 0
+        self.n_retries = 0
+        self.n_failed = 0
+        self.n_superseded = 0
+        self.rtt_sum = 0.0
+        self.th = Thread(target=self.run, name='cmdpipe')
+        self.th.daemon = True
+        self.th.start()
+
+    def submit(self, cmd: str) -> None:
+        """Queue cmd, never blocks."""
+        with self.cond:
+            self.seq = (self.seq + 1) & 0xffff
+            self.pending.append((self.seq, cmd))
+            key = command_key(cmd)
+            if key is not None:
+                self.latest[key] = self.seq
+            self.cond.notify()
+
+    def on_ack(self, lst: list[str]) -> None:
+        """Handle an 'ack <seq>' or 'nak <seq> ...' line split in lst."""
+        try:
+            seq = int(lst[1], 16)
+        except (IndexError, ValueError):
+            print(f'WARN: cmdpipe: bad acknowledge {lst}')
+            return
+        with self.cond:
+            entry = self.inflight.pop(seq, None)
+            if entry is None:
+                return  # late ack of a command already resent or given up
+            if lst[0] == 'ack':
+                self.n_acked += 1
+                self.rtt_sum += time.monotonic() - entry[1]
+            else:
+                self.n_failed += 1
+                print(f'ERROR: gateway rejected "{entry[0]}": {" ".join(lst[2:])}')
+            self.cond.notify()
+
+    def clear(self) -> None:
+        """Forget pending and in flight commands, e.g. when disconnecting."""
+        with self.cond:
+            self.pending.clear()
+            self.inflight.clear()
+
+    def expire(self, now: float) -> list:
+        """Return commands to resend; call with cond held."""
+        resend = []
+        for seq, entry in list(self.inflight.items()):
+            if now - entry[1] < self.timeout:
+                continue
+            cmd = entry[0]
+            key = command_key(cmd)
+            if key is not None and self.latest[key] != seq:
+                # a newer command sets the same thing: resending would undo it
+                del self.inflight[seq]
+                self.n_superseded += 1
+            elif entry[2] > self.retries:
+                del self.inflight[seq]
+                self.n_failed += 1
+                print(f'ERROR: no acknowledge for "{cmd}" after {self.retries} retries')
+            else:
+                entry[1] = now
+                entry[2] += 1
+                self.n_retries += 1
+                resend.append((seq, cmd))
+        return resend
+
+    def run(self):
+        """Send pending commands as the window allows and resend timed out ones."""
+        while True:
+            with self.cond:
+                if self.inflight:
+                    self.cond.wait(self.timeout / 2)
+                elif not self.pending:
+                    self.cond.wait()
+                now = time.monotonic()
+                send = self.expire(now)
+                while self.pending and len(self.inflight) < self.window:
+                    seq, cmd = self.pending.popleft()
+                    key = command_key(cmd)
+                    if key is not None and self.latest[key] != seq:
+                        # a newer setpoint is queued: do not send a stale one
+                        self.n_superseded += 1
+                        continue
+                    self.inflight[seq] = [cmd, now, 1]
+                    send.append((seq, cmd))
+                self.n_sent += len(send)
+            for seq, cmd in send:
+                self.write_raw('@{:04x} {}'.format(seq, cmd))
+
+    def report(self) -> str:
+        """Return counters as text."""
+        rtt = self.rtt_sum / self.n_acked * 1e3 if self.n_acked else 0.0
+        return (f'sent={self.n_sent} acked={self.n_acked} retries={self.n_retries} '
+                f'failed={self.n_failed} superseded={self.n_superseded} rtt={rtt:.1f}ms')
@@ -0,0 +1,27 @@
+"""
+Gateway command strings for setpoints, shared by GUI handlers and the
+setpoint profile runner.
+"""
+
+import twai_ids as ids
+
+INV_TWAI_ID = 0x1ffc0700  # Tupã inverter module
+
+
+def msc_curr_ref(x: float) -> str:
+    """Return command setting MSC current reference to x A."""
+    i_ref = (x * 10)
+    if i_ref < 0:
+        i_ref = 0xffff + i_ref
+    return 'send {:04x} {:04x}'.format(ids.MSCID_CURR_REF, int(i_ref))
+
+
+def gsc_max_power(v: float) -> str:
+    """Return command setting GSC maximum output power to v p.u."""
+    return 'send {:04x} {:04x}'.format(ids.GSCID_MAX_POWER, int(v * 1000))
+
+
+def inv(active: bool, da: int) -> list[str]:
+    """Return commands setting Tupã inverter state and duty da, direct and by TWAI."""
+    return ['inv {} {:02}'.format('1' if active else '0', da),
+            'send {:08x} {:02x}'.format(INV_TWAI_ID, (0x80 if active else 0) + da)]
@@ -0,0 +1,128 @@
+"""
+Derived signals computed from decoded signals.
+Formulas are declared with their inputs; the engine orders them in a
+dependency graph and, on each frame, recomputes only the derived values
+reachable from the signals that frame changed. Derived values may be
+inputs of other derived values.
+"""
+
+# pylint: disable=C0103
+
+import math
+
+
+class DerivedEngine:
+    """Dependency graph of derived signals."""
+
+    def __init__(self):
+        self.defs = {}  # name: (inputs, func)
+        self.values = {}  # last value of every raw and derived signal
+        self.order = {}  # name: topological index
+        self.dependents = {}  # signal: derived names using it directly
+        self.plans = {}  # frozenset of changed signals: derived names to evaluate, in order
+
+    def define(self, name: str, inputs: list, func) -> None:
+        """Declare derived signal name = func(*inputs)."""
+        if name in self.defs:
+            raise ValueError(f'derived signal {name} already defined')
+        self.defs[name] = (list(inputs), func)
+        for i in inputs:
+            self.dependents.setdefault(i, []).append(name)
+        self.sort()
+
+    def sort(self) -> None:
+        """Compute topological order, raise ValueError on cycles."""
+        order = {}
+        visiting = set()
+
+        def visit(name):
+            if name in order or name not in self.defs:
+                return
+            if name in visiting:
+                raise ValueError(f'derived signal {name} depends on itself')
+            visiting.add(name)
+            for i in self.defs[name][0]:
+                visit(i)
+            visiting.discard(name)
+            order[name] = len(order)
+
+        for name in self.defs:
+            visit(name)
+        self.order = order
+        self.plans = {}
+
+    def plan(self, changed: frozenset) -> list:
+        """Return derived names affected by changed signals, in evaluation order."""
+        p = self.plans.get(changed)
+        if p is None:
+            affected = set()
+            todo = list(changed)
+            while todo:
+                for d in self.dependents.get(todo.pop(), []):
+                    if d not in affected:
+                        affected.add(d)
+                        todo.append(d)
+            p = self.plans[changed] = sorted(affected, key=self.order.get)
+        return p
+
+    def update(self, changed: dict) -> dict:
+        """Store changed raw values, return {name: value} of recomputed derived signals."""
+        values = self.values
+        values.update(changed)
+        out = {}
+        for name in self.plan(frozenset(changed)):
+            inputs, func = self.defs[name]
+            try:
+                x = func(*[values[i] for i in inputs])
+            except (KeyError, ZeroDivisionError, ValueError):
+                continue  # input not received yet or out of domain
+            if x is None:
+                continue
+            values[name] = out[name] = x
+        return out
+
+
+def rpm2rad(rpm):
+    """Convert rpm value to rad/s value."""
+    return rpm * math.pi / 30
+
+
+def imbalance(a, b, c):
+    """Return (max - min) / mean of three phases in %."""
+    mean = (a + b + c) / 3
+    return (max(a, b, c) - min(a, b, c)) / mean * 100
+
+
+def ratio_pct(num, den):
+    """Return num / den in %, None if den is not positive."""
+    return num / den * 100 if den > 0 else None
+
+
+class Autoscale:
+    """Scale maximum growing in steps of 10 above a minimum, like the MSC frequency bar."""
+
+    def __init__(self, minimum: float):
+        self.max = minimum
+
+    def __call__(self, x):
+        """Return new maximum, None if unchanged."""
+        x_max = math.ceil(round(x / 10 + 1) * 10)
+        if x_max <= self.max:
+            return None
+        self.max = x_max
+        return self.max
+
+
+def default_engine(msc_f_max: float) -> DerivedEngine:
+    """Return engine with the derived signals of the supervisor."""
+    e = DerivedEngine()
+    e.define('gsc_s_total', ['vga_rms', 'vgb_rms', 'vgc_rms', 'ila_rms', 'ilb_rms', 'ilc_rms'],
+             lambda va, vb, vc, ia, ib, ic: (va * ia + vb * ib + vc * ic) * 1e-3)
+    e.define('gsc_il_imbalance', ['ila_rms', 'ilb_rms', 'ilc_rms'], imbalance)
+    e.define('gsc_vg_imbalance', ['vga_rms', 'vgb_rms', 'vgc_rms'], imbalance)
+    e.define('msc_i_imbalance', ['ia_rms', 'ib_rms', 'ic_rms'], imbalance)
+    e.define('msc_speed', ['msc_rpm'], rpm2rad)
+    e.define('msc_pmech', ['msc_tel', 'msc_speed'], lambda tel, w: tel * w * 1e-3)
+    e.define('efficiency', ['gsc_power', 'msc_pout'], ratio_pct)
+    e.define('msc_f_max', ['msc_fs'], Autoscale(msc_f_max))
+    return e
@@ -0,0 +1,231 @@
+"""
+Export decoded signals to local or LAN clients, without touching the serial
+link:
+
+  * HTTP GET /metrics in Prometheus text format, on `port`;
+  * a push stream on TCP `port + 1`: a client sends one line
+        sub <rate Hz> <signal,signal,...|*>
+    and then receives at that rate one JSON object per line with the
+    signals changed since its previous message, {"ts": ns, "name": value}.
+
+Each changed value is serialized once per frame in publish(), whatever the
+number of clients; a message is just a join of those fragments. Every
+client has a bounded queue: when it is full the oldest message is dropped
+and the next message is a full snapshot of the subscribed signals, so the
+changes lost with it are resent. A client whose socket stays blocked is
+disconnected, so slow clients never stall the decode path.
+"""
+
+# pylint: disable=C0103
+
+import socket
+import socketserver
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Lock, Thread
+
+QUEUE = 64  # messages queued per stream client
+SEND_TIMEOUT = 5.0  # s a stream client may block before being dropped
+MAX_RATE = 100.0  # Hz
+TICK = 0.005  # s, stream scheduler resolution
+
+
+class SignalStore:
+    """Latest value of every signal, pre-serialized."""
+
+    def __init__(self):
+        self.mut = Lock()
+        self.json = {}  # name: b'"name":value'
+        self.prom = {}  # name: b'abv_name value\n'
+        self.version = {}  # name: number of the frame that last changed it
+        self.frame = 0
+        self.ts = 0
+
+    def publish(self, values: dict, derived: dict, ts: int) -> None:
+        """Serialize values of one frame, as a sink of main.py."""
+        with self.mut:
+            self.frame += 1
+            self.ts = ts
+            for d in (values, derived):
+                for name, x in d.items():
+                    txt = repr(float(x))
+                    self.json[name] = f'"{name}":{txt}'.encode('ascii')
+                    self.prom[name] = f'abv_{name} {txt}\n'.encode('ascii')
+                    self.version[name] = self.frame
+
+    def metrics(self) -> bytes:
+        """Return all signals in Prometheus text format."""
+        with self.mut:
+            lines = [b'# TYPE abv_%s gauge\n%s' % (name.encode('ascii'), line)
+                     for name, line in self.prom.items()]
+        return b''.join(lines)
+
+    def message(self, names, since: int):
+        """Return (JSON line of signals in names changed after frame since, frame)."""
+        with self.mut:
+            if names is None:
+                names = self.json.keys()
+            frags = [self.json[n] for n in names if self.version.get(n, 0) > since]
+            frame, ts = self.frame, self.ts
+        if not frags:
+            return None, frame
+        return b'{"ts":%d,%s}\n' % (ts, b','.join(frags)), frame
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve /metrics."""
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.store.metrics()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+
+class StreamClient:
+    """Subscription and bounded outgoing queue of a stream client."""
+
+    def __init__(self, sock, names, rate: float):
+        self.sock = sock
+        self.names = names
+        self.period = 1.0 / rate
+        self.next = time.monotonic()
+        self.since = 0
+        self.queue = deque(maxlen=QUEUE)
+        self.cond = Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def push(self, msg: bytes) -> bool:
+        """Queue msg, dropping the oldest one if full; return False if one was dropped."""
+        with self.cond:
+            full = len(self.queue) == self.queue.maxlen
+            if full:
+                self.dropped += 1
+            self.queue.append(msg)
+            self.cond.notify()
+        return not full
+
+    def send_loop(self) -> None:
+        """Send queued messages until the client goes away or blocks too long."""
+        try:
+            while True:
+                with self.cond:
+                    while not self.queue and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    msg = self.queue.popleft()
+                self.sock.sendall(msg)
+        except OSError:
+            pass  # disconnected, or blocked more than SEND_TIMEOUT
+        finally:
+            self.closed = True
+
+
+class StreamHandler(socketserver.StreamRequestHandler):
+    """Read subscription, then hand the socket to the scheduler."""
+
+    def handle(self):
+        exporter = self.server.exporter
+        self.request.settimeout(SEND_TIMEOUT)
+        try:
+            lst = self.rfile.readline(4096).decode('ascii').split()
+            if len(lst) != 3 or lst[0] != 'sub':
+                raise ValueError('expected: sub <rate> <signals|*>')
+            rate = min(float(lst[1]), MAX_RATE)
+            if rate <= 0:
+                raise ValueError('rate must be positive')
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            try:
+                self.wfile.write(f'ERROR {e}\n'.encode('ascii'))
+            except OSError:
+                pass
+            return
+        names = None if lst[2] == '*' else lst[2].split(',')
+        client = StreamClient(self.request, names, rate)
+        exporter.add_client(client)
+        client.send_loop()
+        exporter.remove_client(client)
+        if client.dropped:
+            print(f'INFO: exporter: {self.client_address} dropped {client.dropped} messages')
+
+
+class StreamServer(socketserver.ThreadingTCPServer):
+    """Push stream server."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Exporter:
+    """HTTP metrics and TCP push stream servers over a SignalStore."""
+
+    def __init__(self, host='127.0.0.1', port=9108):
+        self.store = SignalStore()
+        self.clients = []
+        self.mut = Lock()
+        self.http = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.http.daemon_threads = True
+        self.http.store = self.store
+        self.stream = StreamServer((host, port + 1), StreamHandler)
+        self.stream.exporter = self
+        for target in (self.http.serve_forever, self.stream.serve_forever, self.schedule):
+            th = Thread(target=target)
+            th.daemon = True
+            th.start()
+        print(f'INFO: exporter: http://{host}:{port}/metrics, stream on {host}:{port + 1}')
+
+    def publish(self, values: dict, derived: dict, ts: int) -> None:
+        """Sink of main.py."""
+        self.store.publish(values, derived, ts)
+
+    def add_client(self, client: StreamClient) -> None:
+        """Start streaming to client."""
+        with self.mut:
+            self.clients.append(client)
+
+    def remove_client(self, client: StreamClient) -> None:
+        """Stop streaming to client."""
+        with self.mut:
+            if client in self.clients:
+                self.clients.remove(client)
+        try:
+            client.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def schedule(self) -> None:
+        """Queue a message for every client due, at its rate."""
+        while True:
+            now = time.monotonic()
+            with self.mut:
+                clients = list(self.clients)
+            for c in clients:
+                if c.closed or now < c.next:
+                    continue
+                c.next = max(c.next + c.period, now)
+                msg, c.since = self.store.message(c.names, c.since)
+                if msg is not None and not c.push(msg):
+                    # changes of the dropped message are lost: send all next time
+                    c.since = 0
+            time.sleep(TICK)
+
+    def close(self) -> None:
+        """Stop servers."""
+        self.http.shutdown()
+        self.stream.shutdown()
+        with self.mut:
+            for c in self.clients:
+                with c.cond:
+                    c.closed = True
+                    c.cond.notify()
@@ -0,0 +1,166 @@
+"""
+Streaming harmonic analysis of phase signals from ADC raw frames.
+Samples of each channel are kept in a window; every `hop` new samples (and
+no more often than `min_interval`) the window is resampled on a uniform
+time grid, flat top windowed and transformed with NumPy, giving fundamental
+amplitude, THD and low order harmonics. A channel sampled too slowly for
+the fundamental gives no result; harmonics above half the sample rate are
+not reported, and the highest order analyzed is published as <name>_hmax.
+Packages: numpy
+"""
+
+# pylint: disable=C0103
+
+import numpy as np
+
+# Phase channels: analyzer name -> decoded ADC signal. Adjust to the ADC
+# channel assignment of the converter boards.
+GSC_CHANNELS = {
+    'vga': 'gsc_adc_a2', 'vgb': 'gsc_adc_b2', 'vgc': 'gsc_adc_c2',
+    'ila': 'gsc_adc_a3', 'ilb': 'gsc_adc_b3', 'ilc': 'gsc_adc_c3',
+}
+
+WINDOW = 1024  # samples per analysis
+HOP = 256  # new samples between analyses, i.e. 75% overlap
+N_HARMONICS = 7  # highest harmonic order reported
+MIN_INTERVAL = 0.5  # s, at most two analyses per second per channel
+F_SEARCH = 0.2  # fundamental searched within +-20% of nominal frequency
+PEAK_BINS = 3  # harmonics searched within +-3 bins of h * f1
+
+# Flat top window coefficients: amplitude is read from the peak bin with
+# negligible scalloping loss, whatever the frequency falls between bins.
+FLATTOP = [0.21557895, 0.41663158, 0.277263158, 0.083578947, 0.006947368]
+
+
+def flattop(n: int) -> np.ndarray:
+    """Return flat top window of n samples."""
+    k = np.arange(n) * 2 * np.pi / (n - 1)
+    return sum((-1) ** i * a * np.cos(i * k) for i, a in enumerate(FLATTOP))
+
+
+class Channel:
+    """Circular window of (ts, x) samples."""
+
+    def __init__(self, size: int):
+        self.ts = np.zeros(size, dtype=np.int64)
+        self.x = np.zeros(size)
+        self.n = 0  # samples received
+        self.n_last = 0  # samples received at last analysis
+        self.t_last = 0  # ts of last analysis
+
+    def add(self, ts: int, x: float) -> None:
+        """Append a sample."""
+        i = self.n % len(self.x)
+        self.ts[i] = ts
+        self.x[i] = x
+        self.n += 1
+
+    def window(self):
+        """Return (ts, x) in time order."""
+        i = self.n % len(self.x)
+        return np.roll(self.ts, -i), np.roll(self.x, -i)
+
+
+def sample_rate(ts: np.ndarray) -> float:
+    """Return mean sample rate in Hz of samples at ts (ns), 0 if unknown."""
+    span = (ts[-1] - ts[0]) * 1e-9
+    return (len(ts) - 1) / span if span > 0 else 0.0
+
+
+def min_sample_rate(f_nom: float) -> float:
+    """Return sample rate needed to search the fundamental around f_nom."""
+    return 2 * f_nom * (1 + F_SEARCH)
+
+
+def spectrum(ts: np.ndarray, x: np.ndarray, f_nom: float, n_harmonics: int):
+    """
+    Return (f1, fundamental amplitude, THD %, [harmonic % of fundamental]) of
+    samples x at ts (ns), None if sampled too slowly for f_nom. Harmonics
+    are reported up to half the sample rate.
+    """
+    n = len(x)
+    fs = sample_rate(ts)
+    if fs < min_sample_rate(f_nom):
+        return None
+    t = (ts - ts[0]) * 1e-9
+    # frames do not arrive evenly: resample on a uniform grid
+    xu = np.interp(np.linspace(0.0, t[-1], n), t, x)
+    xu -= xu.mean()
+    w = flattop(n)
+    amp = np.abs(np.fft.rfft(xu * w)) * 2 / w.sum()
+    df = fs / n
+    lo = max(int(f_nom * (1 - F_SEARCH) / df), 1)
+    hi = min(int(f_nom * (1 + F_SEARCH) / df) + 2, len(amp))
+    if lo >= hi:
+        return None
+    k1 = lo + int(np.argmax(amp[lo:hi]))
+    a1 = amp[k1]
+    if a1 <= 0:
+        return None
+    harmonics = []
+    for h in range(2, n_harmonics + 1):
+        k = h * k1
+        if k + PEAK_BINS >= len(amp):
+            break
+        harmonics.append(amp[k - PEAK_BINS:k + PEAK_BINS + 1].max() / a1 * 100)
+    thd = float(np.sqrt(np.sum(np.square(harmonics)))) if harmonics else 0.0
+    return float(k1 * df), float(a1), thd, [float(a) for a in harmonics]
+
+
+class HarmonicAnalyzer:
+    """Feed decoded values, get harmonic signals when a window is analyzed."""
+
+    def __init__(self, channels=None, f_nom=60.0, window=WINDOW, hop=HOP,
+                 n_harmonics=N_HARMONICS, min_interval=MIN_INTERVAL):
+        self.channels = GSC_CHANNELS if channels is None else channels
+        self.by_signal = {sig: name for name, sig in self.channels.items()}
+        self.buf = {name: Channel(window) for name in self.channels}
+        self.f_nom = f_nom
+        self.hop = hop
+        self.n_harmonics = n_harmonics
+        self.min_interval_ns = int(min_interval * 1e9)
+        self.warned = set()  # channels already warned about
+
+    def signal_names(self) -> list:
+        """Return names of all signals the analyzer may publish."""
+        return [f'{name}_{q}' for name in self.channels
+                for q in ['f1', 'fund', 'thd', 'hmax'] + [f'h{h}' for h in range(2, self.n_harmonics + 1)]]
+
+    def warn_once(self, name: str, msg: str) -> None:
+        """Print msg the first time channel name has a problem."""
+        if name not in self.warned:
+            self.warned.add(name)
+            print(f'WARN: harmonics {name}: {msg}')
+
+    def add(self, values: dict, ts: int) -> dict:
+        """Add samples in values received at ts; return new harmonic signals."""
+        out = {}
+        for sig, x in values.items():
+            name = self.by_signal.get(sig)
+            if name is None:
+                continue
+            ch = self.buf[name]
+            ch.add(ts, x)
+            if ch.n < len(ch.x) or ch.n - ch.n_last < self.hop or ts - ch.t_last < self.min_interval_ns:
+                continue
+            ch.n_last = ch.n
+            ch.t_last = ts
+            ts_w, x_w = ch.window()
+            fs = sample_rate(ts_w)
+            if fs < min_sample_rate(self.f_nom):
+                self.warn_once(name, f'{fs:.0f} samples/s, at least {min_sample_rate(self.f_nom):.0f} needed for {self.f_nom:g}Hz')
+                continue
+            r = spectrum(ts_w, x_w, self.f_nom, self.n_harmonics)
+            if r is None:
+                continue
+            f1, a1, thd, harmonics = r
+            hmax = len(harmonics) + 1
+            if hmax < self.n_harmonics:
+                self.warn_once(name, f'{fs:.0f} samples/s, harmonics up to order {hmax} only')
+            out[name + '_hmax'] = hmax
+            out[name + '_f1'] = f1
+            out[name + '_fund'] = a1
+            out[name + '_thd'] = thd
+            for h, a in enumerate(harmonics, 2):
+                out[f'{name}_h{h}'] = a
+        return out
@@ -0,0 +1,113 @@
+"""
+Link capacity probe and baud rate negotiation with the ESP32 gateway.
+Protocol, at the current baud rate:
+
+    host: baud <rate>        gateway: baud ok <rate> | baud nak <rate>
+
+after 'baud ok' both sides switch. The host checks the new rate with a
+burst of 'echo <seq> <payload>' lines that the gateway sends back
+unchanged, then sends 'baud confirm'. A gateway not receiving the confirm
+within a couple of seconds returns to its previous rate, which is what the
+host does when the burst shows errors.
+"""
+
+# pylint: disable=C0103
+
+import os
+import time
+
+BAUD = 115200  # rate after reset
+BAUD_RATES = [2000000, 1500000, 1000000, 921600, 500000, 460800, 230400]
+ECHO_COUNT = 64  # lines of the loopback burst
+ECHO_SIZE = 24  # payload bytes of each echo line, sent in hexadecimal
+REPLY_TIMEOUT = 0.5  # s
+FALLBACK_WAIT = 2.5  # s the gateway waits 'baud confirm' before falling back
+FRAME_SIZE = 32  # bytes of a typical 'twai <id> <data>' line
+NEGOTIATE_TIME = 12.0  # s, limit of negotiate(), below the worker OPEN_TIMEOUT
+TRY_TIME = 2 * REPLY_TIMEOUT + FALLBACK_WAIT  # s, worst case of a failed try_rate()
+BOOT_TIME = 1.0  # s from reset until the gateway answers
+
+
+def read_reply(ser, prefix: str, timeout=REPLY_TIMEOUT):
+    """Return first line starting with prefix split, or None; other lines are dropped."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ll = ser.readline()
+        try:
+            lst = ll.decode('ascii').split()
+        except UnicodeDecodeError:
+            continue
+        if len(lst) > 1 and lst[-1].startswith('@'):
+            lst = lst[:-1]  # gateway tick
+        if lst and lst[0] == prefix:
+            return lst
+    return None
+
+
+def echo_burst(ser):
+    """Send loopback burst; return (errors, bytes per second received)."""
+    payloads = [os.urandom(ECHO_SIZE).hex() for _ in range(ECHO_COUNT)]
+    ser.reset_input_buffer()
+    t0 = time.monotonic()
+    ser.write(b''.join(f'echo {i} {p}\r\n'.encode('ascii') for i, p in enumerate(payloads)))
+    received = 0
+    errors = 0
+    for i, p in enumerate(payloads):
+        lst = read_reply(ser, 'echo')
+        if lst is None:
+            errors += ECHO_COUNT - i
+            break
+        if lst[1:] != [str(i), p]:
+            errors += 1
+        received += len(' '.join(lst)) + 2
+    elapsed = time.monotonic() - t0
+    return errors, received / elapsed if elapsed > 0 else 0.0
+
+
+def try_rate(ser, rate: int):
+    """Switch gateway and ser to rate; return throughput in B/s, 0 on failure."""
+    prev = ser.baudrate
+    ser.reset_input_buffer()
+    ser.write(f'baud {rate}\r\n'.encode('ascii'))
+    lst = read_reply(ser, 'baud')
+    if lst is None or lst[1:3] != ['ok', str(rate)]:
+        return 0.0
+    ser.flush()
+    ser.baudrate = rate
+    errors, throughput = echo_burst(ser)
+    if errors:
+        print(f'WARN: baud {rate}: {errors}/{ECHO_COUNT} echo errors, falling back to {prev}')
+        ser.baudrate = prev
+        time.sleep(FALLBACK_WAIT)
+        ser.reset_input_buffer()
+        return 0.0
+    ser.write(b'baud confirm\r\n')
+    return throughput
+
+
+def negotiate(ser, max_baud: int, time_limit=NEGOTIATE_TIME):
+    """Step ser up to the highest rate up to max_baud both sides support,
+    giving up higher rates after about time_limit seconds.
+    Return (baud rate, measured throughput in B/s)."""
+    deadline = time.monotonic() + time_limit
+    for rate in BAUD_RATES:
+        if rate > max_baud or rate <= ser.baudrate:
+            continue
+        if time.monotonic() + TRY_TIME > deadline:
+            print(f'WARN: baud negotiation time limit, staying at {ser.baudrate}')
+            break
+        throughput = try_rate(ser, rate)
+        if throughput > 0:
+            return rate, throughput
+    # measure at current rate, the gateway echoes at any rate
+    errors, throughput = echo_burst(ser)
+    if errors:
+        print(f'WARN: baud {ser.baudrate}: {errors}/{ECHO_COUNT} echo errors')
+    return ser.baudrate, throughput
+
+
+def capacity(throughput: float) -> str:
+    """Return a text of what a link with throughput (B/s) can carry."""
+    frames = throughput / FRAME_SIZE
+    # a meas poll of one converter answers 4 frames
+    return '{:.0f}kB/s, {:.0f} frames/s, {:.0f} meas polls/s'.format(throughput * 1e-3, frames, frames / 4)
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+"""
+Memory mapped table of live signal values for local read only consumers.
+Layout (little endian):
+
+    header  <8sIIQQ  magic, schema version, number of signals n,
+                     sequence counter, monotonic ns of last update
+    names   n x 32 bytes, NUL padded UTF-8
+    values  n x <dq  value, monotonic ns the value was received (0: never)
+
+The writer increments the sequence counter before and after each update
+(seqlock): a reader copies the values, and retries if the counter was odd
+or changed meanwhile. Reading is plain memory access, with no load on the
+supervisor; a reader only yields the CPU if it hits an update in progress.
+"""
+
+# pylint: disable=C0103
+
+import mmap
+import os
+import struct
+import sys
+import time
+
+MAGIC = b'ABVLIVE\0'
+SCHEMA = 1
+HEADER = struct.Struct('<8sIIQQ')
+HEADER_SIZE = 64
+SEQ_OFFSET = 16
+NAME_SIZE = 32
+VALUE = struct.Struct('<dq')
+DEFAULT_PATH = '/dev/shm/abv_superv.live'
+
+
+def table_size(n: int) -> int:
+    """Return file size of a table of n signals."""
+    return HEADER_SIZE + n * (NAME_SIZE + VALUE.size)
+
+
+class LiveTableWriter:
+    """Publish values of a fixed list of signals."""
+
+    def __init__(self, names: list, path=DEFAULT_PATH):
+        self.path = path
+        self.index = {name: i for i, name in enumerate(names)}
+        self.values_offset = HEADER_SIZE + len(names) * NAME_SIZE
+        self.seq = 0
+        # build in a temporary file: readers never map a half written header
+        tmp = f'{path}.{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, SCHEMA, len(names), 0, 0).ljust(HEADER_SIZE, b'\0'))
+            for name in names:
+                f.write(name.encode('utf-8')[:NAME_SIZE - 1].ljust(NAME_SIZE, b'\0'))
+            f.write(bytes(len(names) * VALUE.size))
+        os.replace(tmp, path)
+        fd = os.open(path, os.O_RDWR)
+        try:
+            self.mm = mmap.mmap(fd, table_size(len(names)))
+        finally:
+            os.close(fd)
+
+    def publish(self, values: dict, derived: dict, ts: int) -> None:
+        """Write values of one frame, as a sink of main.py."""
+        mm = self.mm
+        self.seq += 1
+        struct.pack_into('<Q', mm, SEQ_OFFSET, self.seq)
+        for d in (values, derived):
+            for name, x in d.items():
+                i = self.index.get(name)
+                if i is not None:
+                    VALUE.pack_into(mm, self.values_offset + i * VALUE.size, x, ts)
+        self.seq += 1
+        struct.pack_into('<QQ', mm, SEQ_OFFSET, self.seq, ts)
+
+    def close(self, remove=True) -> None:
+        """Unmap and optionally remove the table."""
+        self.mm.close()
+        if remove:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class LiveTableReader:
+    """Read consistent snapshots of a live table."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, schema, n, _, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or schema != SCHEMA:
+            raise ValueError(f'{path}: not a live table of schema {SCHEMA}')
+        self.names = [bytes(self.mm[HEADER_SIZE + i * NAME_SIZE:HEADER_SIZE + (i + 1) * NAME_SIZE]).rstrip(b'\0').decode('utf-8')
+                      for i in range(n)]
+        self.values_offset = HEADER_SIZE + n * NAME_SIZE
+        self.values_fmt = struct.Struct('<' + 'dq' * n)
+
+    def snapshot(self, retries=1000):
+        """Return (sequence, {name: (value, ts)}) consistent across signals."""
+        mm = self.mm
+        for _ in range(retries):
+            seq = struct.unpack_from('<Q', mm, SEQ_OFFSET)[0]
+            if not seq & 1:
+                raw = self.values_fmt.unpack_from(mm, self.values_offset)
+                if struct.unpack_from('<Q', mm, SEQ_OFFSET)[0] == seq:
+                    return seq, {name: (raw[2 * i], raw[2 * i + 1])
+                                 for i, name in enumerate(self.names) if raw[2 * i + 1]}
+            # writer is in the middle of an update: let it run
+            time.sleep(0)
+        raise TimeoutError('live table is being updated continuously')
+
+    def close(self) -> None:
+        """Unmap table."""
+        self.mm.close()
+
+
+def main():
+    """Print a snapshot of the live table."""
+    reader = LiveTableReader(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH)
+    seq, values = reader.snapshot()
+    now = time.monotonic_ns()
+    print(f'sequence {seq}')
+    for name, (x, ts) in values.items():
+        print('{:<24} {:>12.3f} {:>8.1f}s ago'.format(name, x, (now - ts) * 1e-9))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,36 @@
 #!/usr/bin/python3
 """
 Supervisory for GSC and MSC by means of a ESP32.
- Packages: pyserial
+ Packages: pyserial, numpy for --harmonics
 .
 """
 
 # pylint: disable=C0103,C0301,W0603,C0209
 
+import argparse
 import math
+import signal
 # import socket
 import time
+import traceback
 # import subprocess
 # import sys, getopt, os
 from threading import Thread
-import struct
 import ctypes
 # from termcolor import colored
 import gi
+from archive import ArchiveWriter
 from canserial import CanSerial
+from derived import default_engine
+from exporter import Exporter
+import commands
+import linkprobe
+import livetable
+import paramcache
+from profiler import Profiler, ProfiledBuilder
+from serial_worker import SerialProcess
+from setpoints import ProfileRunner
+import signals as sig
 import twai_ids as ids
 
 gi.require_version("Gtk", "3.0")
@@ -33,7 +46,7 @@ CURRENT_MAX = 50.0
 
 # Global parameters
 
-running_states = ['INIT', 'OFFSET', 'PLL', 'ENC_CAL', 'READY', 'RUNNING', 'OVERHEAT', 'OPENPHASE', 'HIGH_VBUS', 'ENC_FAIL', 'DISCHARGE', 'I_IMBALANCE', 'V_IMBALANCE']
+running_states = sig.RUNNING_STATES
 
 gsc_vbus = 0.0
 gsc_vbus_max = 0.0  # Maximum bus voltage
@@ -71,6 +84,23 @@ msc_v_nom = 10
 inv_da: int = 0
 inv_active: bool = False
 
+#
+# Setpoint profile
+#
+alarm_states = ['OVERHEAT', 'OPENPHASE', 'HIGH_VBUS', 'ENC_FAIL', 'I_IMBALANCE', 'V_IMBALANCE']
+msc_status: int = 0
+runner = None  # setpoints.ProfileRunner while a profile is running
+
+#
+# Parameter cache
+#
+PARAM_REVALIDATE_INTERVAL = 3000  # ms between parameter requests when cached
+param_cache = paramcache.ParamCache()
+param_key = ''  # cache key of connected gateway and firmware
+param_timer = 0  # GLib source of pending parameter requests
+
+frame_ts: int = 0  # monotonic ns of the line being handled, gateway aligned if possible
+
 
 def rad2rpm(rad):
     """Convert radian value to degree value."""
@@ -110,28 +140,40 @@ class Handler:
 
     def on_disconnect_clicked(self, _):
         """Act when disconnect button is clecked."""
+        global param_key
+        if runner is not None:
+            runner.stop()
+        cancel_param_requests()
         myser.disconnect()
         self.builder.get_object('serial_device').set_sensitive(True)
         self.builder.get_object('connect').set_sensitive(True)
         self.builder.get_object('disconnect').set_sensitive(False)
         self.builder.get_object('version').set_text('Version: XXXXX')
+        param_key = ''
 
     def on_connect_clicked(self, _):
         """Connect to serial when button is clicked."""
         combo = self.builder.get_object('serial_device')
         name = combo.get_active_text()
+        cancel_param_requests()
         myser.open(name)
         version = self.builder.get_object('version')
         version.set_text('Version: ?????')
         serial_status = self.builder.get_object('serial_status')
-        if myser.ser.isOpen():
+        if myser.is_open():
             print('Serial {} openned successfuly'.format(name))
             serial_status.set_from_stock(Gtk.STOCK_APPLY, Gtk.IconSize.LARGE_TOOLBAR)
+            info = '{} baud'.format(myser.baudrate)
+            if myser.throughput > 0:
+                info += ': ' + linkprobe.capacity(myser.throughput)
+            serial_status.set_tooltip_text(info)
             print('Serial device changed')
 
             self.builder.get_object('serial_device').set_sensitive(False)
             self.builder.get_object('connect').set_sensitive(False)
             self.builder.get_object('disconnect').set_sensitive(True)
+            if args.setpoints:
+                start_setpoints(args.setpoints)
         else:
             serial_status.set_from_stock(Gtk.STOCK_DIALOG_WARNING, Gtk.IconSize.LARGE_TOOLBAR)
 
@@ -151,13 +193,15 @@ class Handler:
     def on_gsc_max_power_value_changed(self, wdg):
         """Send maximum output power in p.u."""
         v = wdg.get_value()
-        myser.write('send {:04x} {:04x}'.format(ids.GSCID_MAX_POWER, int(v * 1000)))
+        myser.write(commands.gsc_max_power(v))
 
     #
     # MSC
     #
     def on_msc_stop_clicked(self, _btn):
         """Button stop clicked."""
+        if runner is not None:
+            runner.stop(safe=False)
         msc_i_ref = self.builder.get_object('msc_i_ref')
         msc_i_ref.set_value(0.0)
         myser.write('send {:04x} 0000'.format(ids.MSCID_CURR_REF))
@@ -165,37 +209,30 @@ class Handler:
     def on_adj_op_current_value_changed(self, wdg):
         """Current reference for MSC convert."""
         x = wdg.get_value()
+        if runner is not None:
+            # the operator takes over from the setpoint profile
+            runner.stop(safe=False)
         print(f'set: msc_i_ref={x}')
-        i_ref = (x * 10)
-        if i_ref < 0:
-            i_ref = 0xffff + i_ref
-        cmd = 'send {:04x} {:04x}'.format(ids.MSCID_CURR_REF, int(i_ref))
-        myser.write(cmd)
+        myser.write(commands.msc_curr_ref(x))
 
     def on_inv_active_toggled(self, wdg):
         """Send command to Tupã module."""
         global inv_active
         inv_active = wdg.get_active()
-        cmd = 'inv {} {:02}'.format('1' if inv_active else '0', inv_da)
-        print(f'INV: {cmd}')
-        myser.write(cmd)
-        # To TWAI:
-        cmd = 'send 1ffc0700 {:02x}'.format((0x80 if inv_active else 0) + inv_da)
-        print(f'INV: {cmd}')
-        myser.write(cmd)
+        # direct and to TWAI:
+        for cmd in commands.inv(inv_active, inv_da):
+            print(f'INV: {cmd}')
+            myser.write(cmd)
 
     def on_inv_da_value_changed(self, wdg):
         """Send command to Tupã module."""
         global inv_da
         inv_da = int(wdg.get_value())
         if inv_active:
-            cmd = 'inv 1 {:02}'.format(inv_da)
-            print(f'INV: {cmd}')
-            myser.write(cmd)
-            # To TWAI:
-            cmd = 'send 1ffc0700 {:02x}'.format((0x80 if inv_active else 0) + inv_da)
-            print(f'INV: {cmd}')
-            myser.write(cmd)
+            # direct and to TWAI:
+            for cmd in commands.inv(inv_active, inv_da):
+                print(f'INV: {cmd}')
+                myser.write(cmd)
 
     def on_msc_adc_raw_toggled(self, wdg):
         if wdg.get_active():
@@ -225,79 +262,104 @@ class Handler:
             myser.write('send {:04x} 01'.format(ids.GSCID_CONTROL_MODE))
 
 
+def request_params(reqs: list) -> bool:
+    """Send first request of reqs, as GLib timeout keep going while any is left."""
+    global param_timer
+    msg, cmd = reqs.pop(0)
+    print(f'INFO: sending {msg} request')
+    myser.write(cmd)
+    if not reqs:
+        param_timer = 0
+    return len(reqs) > 0
+
+
+def cancel_param_requests() -> None:
+    """Drop parameter requests pending for a previous connection."""
+    global param_timer
+    if param_timer:
+        GLib.source_remove(param_timer)
+        param_timer = 0
+
+
 def set_version(ver):
     """Set ESP32 firmware version."""
+    global param_key, param_timer
     version = builder.get_object('version')
     version.set_text('Version: {}'.format(ver[1]))
+    # Apply parameters and offsets last received from a gateway reporting this version
+    cancel_param_requests()
+    param_key = paramcache.cache_key(ver[1:])
+    cached = param_cache.get(param_key)
+    for can_id, data in cached.items():
+        get_twai_data(['twai', '{:04x}'.format(can_id), data])
     # Taking a chance to get parameters:
-    print('INFO: sending MSC parameters request')
-    myser.write('send {:04x} 0001'.format(ids.MSCID_DATA_REQ))
-    print('INFO: sending GSC parameters group 1 and 2 request')
-    myser.write('send {:04x} 0003'.format(ids.GSCID_DATA_REQ))
-
-
-def str_to_size(s: str, size: int) -> str:
-    """Fill the beginning of string with zeroes."""
-    while len(s) < size:
-        s = '0' + s
-    return s
-
-
-def CANDataToString(s: str, k=1.0, n_dec=0, unit='') -> str:
-    """Return a string representing the value from CAN data represented by string s, multiplied by k with n_dec number of decimal digits, appended by unit."""
-    # global builder
-    val = struct.unpack("!i", bytes.fromhex(str_to_size(s, 8)))[0] * k
-    s = f'{{:.{n_dec}f}}{unit}'
-    return s.format(val)
-
-
-def CANDataToInt16(s: str) -> int:
-    "Return signed integer from string s being data of CAN message."
-    val = struct.unpack("!h", bytes.fromhex(s))[0]
-    return val
-
-
-def CANDataToUInt16(s: str) -> int:
-    "Return signed integer from string s being data of CAN message."
-    val = struct.unpack("!H", bytes.fromhex(s))[0]
-    return val
+    reqs = [('MSC parameters', 'send {:04x} 0001'.format(ids.MSCID_DATA_REQ)),
+            ('GSC parameters group 1 and 2', 'send {:04x} 0003'.format(ids.GSCID_DATA_REQ))]
+    if any(can_id in cached for can_id in (ids.MSCID_OFF_1, ids.MSCID_OFF_2)):
+        reqs.append(('MSC offsets', 'send {:04x} 0300'.format(ids.MSCID_DATA_REQ)))
+    if any(can_id in cached for can_id in (ids.GSCID_OFF_1, ids.GSCID_OFF_2)):
+        reqs.append(('GSC offsets', 'send {:04x} 0300'.format(ids.GSCID_DATA_REQ)))
+    if cached:
+        # revalidate in background, spread out of the connect burst
+        print(f'INFO: applied {len(cached)} cached parameter frames')
+        param_timer = GLib.timeout_add(PARAM_REVALIDATE_INTERVAL, request_params, reqs)
+    else:
+        while reqs:
+            request_params(reqs)
+
+
+def converter_alarm() -> str:
+    """Return a description if GSC or MSC is in an alarm state, else ''."""
+    for name, status in [('GSC', gsc_status), ('MSC', msc_status)]:
+        if status < len(running_states) and running_states[status] in alarm_states:
+            return f'{name} {running_states[status]}'
+    return ''
+
+
+def start_setpoints(name: str) -> None:
+    """Load setpoint profile from file name and run it."""
+    global runner
+    if runner is not None:
+        runner.stop()
+    try:
+        initial = {'msc_i_ref': builder.get_object('adj_op_current').get_value(),
+                   'gsc_max_power': builder.get_object('gsc_max_power').get_value(),
+                   'inv_da': inv_da}
+        runner = ProfileRunner.from_file(name, myser.write, converter_alarm, lambda: inv_active,
+                                         initial, {'msc_i_ref': (-CURRENT_MAX, CURRENT_MAX)})
+    except (OSError, ValueError, KeyError) as e:
+        print(f'ERROR: loading setpoint profile {name}: {e}')
+        runner = None
+        return
+    runner.start()
 
 
-def builder_set(s: str, label: str, k=1.0, n_dec=0, unit='', signed=True) -> None:
-    """Set a GTK label with value from s, no scale."""
+def builder_set(x: float, label: str, n_dec=0, unit='') -> None:
+    """Set a GTK label with value x."""
     # global builder
-    if signed:
-        val = CANDataToInt16(s) * k
-    else:
-        val = CANDataToUInt16(s) * k
     fmt = f'{{:.{n_dec}f}}{unit}'
-    builder.get_object(label).set_text(fmt.format(val))
+    builder.get_object(label).set_text(fmt.format(x))
 
 
-def gsc_vbus_n_status(s):
+def gsc_vbus_n_status(v: dict) -> None:
     """
-    Extract Vbus and status from s.
+    Extract Vbus and status from v.
     """
     # global builder
     global gsc_vbus, gsc_status
-    if not len(s) == 10:
-        print(f'ERROR: gsc_vbus_n_status: s={s} has not 10 chars')
     # P_out and status
-    data = CANDataToUInt16(s[0:4])
-    gsc_vbus = data * 0.1
+    gsc_vbus = v['gsc_vbus']
     txt = '{:.1f}'.format(gsc_vbus)
     builder.get_object('gsc_vbus').set_text(txt)
     builder.get_object('gsc_vbus_lvl').set_value(gsc_vbus)
-    # print('data={:d} 0x{:x}'.format(data, data))
-    data = CANDataToUInt16(s[4:8])
-    p_out = data * 0.1
+    p_out = v['gsc_power']
     txt = '{:.1f}'.format(p_out)
     builder.get_object('gsc_power').set_text(txt)
     builder.get_object('gsc_power_lvl').set_value(p_out)
     builder.get_object('gsc_power_lvl').set_max_value(gsc_power_max * 0.001)
     builder.get_object('gsc_power_max').set_text('{:.0f}kW'.format(gsc_power_max * 0.001))
 
-    gsc_status = struct.unpack("!B", bytes.fromhex(s[8:10]))[0]
+    gsc_status = int(v['gsc_state'])
     if gsc_status in (5, 10):
         builder.get_object('gsc_inv_enabled').set_active(True)
     if gsc_status < len(running_states):
@@ -306,50 +368,42 @@ def gsc_vbus_n_status(s):
         builder.get_object('gsc_state').set_text(f'??? status={gsc_status}')
 
 
-def set_gsc_hs_temp(s):
+def set_gsc_hs_temp(v: dict) -> None:
     """
     Heatsink temperature.
     """
     # global builder
     global gsc_hs_temp
-    # print(f'gsc_hs_temp: setting temp {s}')
-    if not len(s) == 4:
-        print(f'ERROR: gsc_hs_temp: s={s} has not 4 chars')
-    gsc_hs_temp = CANDataToInt16(s) * 0.1
+    gsc_hs_temp = v['gsc_hs_temp']
     builder.get_object('gsc_hs_temp').set_text('{:.1f}'.format(gsc_hs_temp))
 
 
-def gsc_params_1(s):
+def gsc_params_1(v: dict) -> None:
     """
     Parameters group 1
     target_fp, vgrid_nom, max_peak_current, droop_coef
     """
     # global gsc_power_max
     global gsc_i_max, gsc_i_min, gsc_f_nom
-    if not len(s) == 12:
-        print(f'ERROR: gsc_params_1: s={s} has not 12 chars')
-    # print(f'target_fp = {s[0:4]}')
-    gsc_i_max = float(CANDataToInt16(s[0:4]))
+    gsc_i_max = v['gsc_i_max']
     txt = "{:.1f}".format(gsc_i_max)
     builder.get_object("gsc_i_max").set_text(txt)
     if gsc_vbus_max != 0:
         builder.get_object('gsc_power_max').set_text('{:.1f}'.format(gsc_power_max))
         # builder.get_object('gsc_power_lvl').set_max_value(gsc_power_max)
-    gsc_i_min = float(CANDataToInt16(s[4:8]))
+    gsc_i_min = v['gsc_i_min']
     builder.get_object('gsc_i_min').set_text('{:.1f}'.format(gsc_i_min))
-    gsc_f_nom = float(CANDataToInt16(s[8:12]))
+    gsc_f_nom = v['gsc_f_nom']
     builder.get_object('gsc_f_nom').set_text('{:.1f}'.format(gsc_f_nom))
 
 
-def gsc_params_2(s: str) -> None:
+def gsc_params_2(v: dict) -> None:
     """
     Parameters group 2
     """
     global gsc_vbus_max
-    if not len(s) == 16:
-        print(f'ERROR: gsc_params_2: s={s} has not 16 chars')
     # VBUS_MAX
-    gsc_vbus_max = float(CANDataToUInt16(s[0:4]))
+    gsc_vbus_max = v['gsc_vbus_max']
     if gsc_i_max != 0:
         builder.get_object('gsc_power_max').set_text('{:.0f}kW'.format(gsc_power_max))
         # builder.get_object('gsc_power_lvl').set_max_value(gsc_power_max)
@@ -357,292 +411,203 @@ def gsc_params_2(s: str) -> None:
     builder.get_object("gsc_vbus_max").set_text(txt)
     builder.get_object("gsc_vbus_peak").set_text(txt)
     builder.get_object("gsc_vbus_lvl").set_max_value(gsc_vbus_max)
-    # VBUS_TARGET_MAX
-    x = float(CANDataToUInt16(s[4:8]))
-    builder.get_object("gsc_vbus_target_max").set_text('{:.1f}'.format(x))
-    # VBUS_TARGET_MIN
-    x = float(CANDataToUInt16(s[8:12]))
-    builder.get_object("gsc_vbus_target_min").set_text('{:.1f}'.format(x))
-    # VBUS_MIN
-    x = float(CANDataToUInt16(s[12:16]))
-    builder.get_object("gsc_vbus_min").set_text('{:.1f}'.format(x))
-
-
-def gsc_meas_1(s):
+    # VBUS_TARGET_MAX, VBUS_TARGET_MIN and VBUS_MIN
+    for name in ['gsc_vbus_target_max', 'gsc_vbus_target_min', 'gsc_vbus_min']:
+        builder_set(v[name], name, 1)
+
+
+def gsc_meas_1(v: dict) -> None:
     """
     Measures group 1
     ila_rms, ilb_rms, ilc_rms, gsc_i_imbalance
     """
-    # global builder
-    if not len(s) == 16:
-        print(f'ERROR: gsc_meas_1: s={s} has not 16 chars')
-    builder_set(s[0:4], 'ila_rms', 0.1, 1)
-    builder_set(s[4:8], 'ilb_rms', 0.1, 1)
-    builder_set(s[8:12], 'ilc_rms', 0.1, 1)
-    builder_set(s[12:16], 'gsc_i_imbalance')
+    for name in ['ila_rms', 'ilb_rms', 'ilc_rms']:
+        builder_set(v[name], name, 1)
+    builder_set(v['gsc_i_imbalance'], 'gsc_i_imbalance')
 
 
-def gsc_meas_2(s):
+def gsc_meas_2(v: dict) -> None:
     """
     Measures group 1 pt 2.
-    vga_rms, vgb_rms, vgc_rms, ila_avg, ilb_avg, ilc_avg
+    ila_avg, ilb_avg, ilc_avg
     """
-    # global builder
-    if not len(s) == 12:
-        print(f'ERROR: gsc_meas_2: s={s} has not 12 chars')
-        return
-    builder_set(s[0:4], 'ila_avg', 0.1, 1, signed=True)
-    builder_set(s[4:8], 'ilb_avg', 0.1, 1, signed=True)
-    builder_set(s[8:12], 'ilc_avg', 0.1, 1, signed=True)
+    for name in ['ila_avg', 'ilb_avg', 'ilc_avg']:
+        builder_set(v[name], name, 1)
 
 
-def gsc_meas_3(s):
+def gsc_meas_3(v: dict) -> None:
     """
     Measures group 1 pt 2.
     vga_rms, vgb_rms, vgc_rms, gsc_v_imbalance
     """
-    # global builder
-    if not len(s) == 16:
-        print(f'ERROR: gsc_meas_3: s={s} has not 16 chars')
-        return
-    builder_set(s[0:4], 'vga_rms', 0.1, 1)
-    builder_set(s[4:8], 'vgb_rms', 0.1, 1)
-    builder_set(s[8:12], 'vgc_rms', 0.1, 1)
-    builder_set(s[12:16], 'gsc_v_imbalance')
+    for name in ['vga_rms', 'vgb_rms', 'vgc_rms']:
+        builder_set(v[name], name, 1)
+    builder_set(v['gsc_v_imbalance'], 'gsc_v_imbalance')
 
 
-def gsc_meas_4(s):
+def gsc_meas_4(v: dict) -> None:
     """
     Measures group 1 pt 2.
-    vga_rms, vgb_rms, vgc_rms, ila_avg
+    vga_avg, vgb_avg, vgc_avg
     """
-    # global builder
-    if not len(s) == 12:
-        print(f'ERROR: gsc_meas_4: s={s} has not 12 chars')
-        return
-    builder_set(s[0:4], 'vga_avg', 0.1, 1, signed=True)
-    builder_set(s[4:8], 'vgb_avg', 0.1, 1, signed=True)
-    builder_set(s[8:12], 'vgc_avg', 0.1, 1, signed=True)
+    for name in ['vga_avg', 'vgb_avg', 'vgc_avg']:
+        builder_set(v[name], name, 1)
+
 
+def set_labels(v: dict, n_dec=0) -> None:
+    """Set GTK labels named as the signals of v."""
+    for name, x in v.items():
+        builder_set(x, name, n_dec)
 
-def can_gsc_adc_1(s):
+
+def can_gsc_adc_1(v: dict) -> None:
     """ADC calibration measures group 1."""
-    # global builder
-    if not len(s) == 16:
-        print(f'ERROR: can_gsc_adc_1: s={s} has not 16 chars')
-        return
-    builder_set(s[0:4], "gsc_adc_a1")
-    builder_set(s[4:8], "gsc_adc_a2")
-    builder_set(s[8:12], "gsc_adc_a3")
-    builder_set(s[12:16], "gsc_adc_a4")
+    set_labels(v)
     # copies
-    # builder_set(s[0:4], "gsc_adc_a1_")
-    # builder_set(s[4:8], "gsc_adc_a2_")
-    # builder_set(s[8:12], "gsc_adc_a3_")
-    # builder_set(s[12:16], "gsc_adc_a4_")
+    # builder_set(v['gsc_adc_a1'], "gsc_adc_a1_")
 
 
-def can_gsc_adc_2(s):
+def can_gsc_adc_2(v: dict) -> None:
     """Set ADC group 2: ADC_B14, ADC_B2 .. 4."""
-    if not len(s) == 16:
-        print(f'ERROR: can_gsc_adc_2: s={s} has not 16 chars')
-        return
-    builder_set(s[0:4], 'gsc_adc_b14')
-    builder_set(s[4:8], 'gsc_adc_b2')
-    builder_set(s[8:12], 'gsc_adc_b3')
-    builder_set(s[12:16], 'gsc_adc_b4')
+    set_labels(v)
     # no copies
 
 
-def can_gsc_adc_3(s):
+def can_gsc_adc_3(v: dict) -> None:
     """Set ADC group 2: ADC_C14, ADC_C2 .. 4."""
-    if not len(s) == 16:
-        print(f'ERROR: can_gsc_adc_3: s={s} has not 16 chars')
-        return
-    builder_set(s[0:4], 'gsc_adc_c14')
-    builder_set(s[4:8], 'gsc_adc_c2')
-    builder_set(s[8:12], 'gsc_adc_c3')
-    builder_set(s[12:16], 'gsc_adc_c4')
+    set_labels(v)
     # copies
-    # builder_set(s[4:8], 'gsc_adc_c2_')
-    # builder_set(s[12:16], 'gsc_adc_c4_')
+    # builder_set(v['gsc_adc_c2'], 'gsc_adc_c2_')
 
 
-def gsc_offset_1(s):
-    builder_set(s[0:4], 'vga_off', k=0.1, n_dec=1)
-    builder_set(s[4:8], 'vgb_off', k=0.1, n_dec=1)
-    builder_set(s[8:12], 'vgc_off', k=0.1, n_dec=1)
-    builder_set(s[12:16], 'gsc_vbus_off', k=0.1, n_dec=1)
+def gsc_offset_1(v: dict) -> None:
+    set_labels(v, 1)
 
 
-def gsc_offset_2(s):
-    builder_set(s[0:4], 'ila_off', k=0.1, n_dec=1)
-    builder_set(s[4:8], 'ilb_off', k=0.1, n_dec=1)
-    builder_set(s[8:12], 'ilc_off', k=0.1, n_dec=1)
+def gsc_offset_2(v: dict) -> None:
+    set_labels(v, 1)
 
 
-def msc_vbus_etal(s: str) -> None:
+def msc_vbus_etal(v: dict) -> None:
     "Receive MSC Vbus, stator current, electric machine frequency Hz and status (which is not well defined)."
-    if not len(s) == 16:
-        print(f'ERROR: msc_vbus_etal: s={s} has not 16 chars')
-        return
     # print('can_msc_vbus_etal:')
     # Vbus
-    x = abs(CANDataToUInt16(s[0:4]) * 0.1)
+    x = abs(v['msc_vbus'])
     txt = "{:.1f}".format(x)
     builder.get_object('msc_vbus').set_text(txt)
     builder.get_object('msc_vbus_lvl').set_value(x)
     # print(f'can_msc_vbus_etal: Vbus={txt}')
     # Line Current
-    x = CANDataToUInt16(s[4:8]) * 0.1
+    x = v['msc_pout']
     txt = "{:.1f}kW".format(x)
     builder.get_object('msc_pout').set_text(txt)
     builder.get_object('msc_pout_lvl').set_value(x)
     # Frequency
-    d = int(CANDataToUInt16(s[8:12]))
-    f_e = d >> 7
-    print(f'f_e={f_e}')
-    f_e_max = round(f_e / 10 + 1) * 10
-    global msc_f_max
-    if f_e_max > msc_f_max:
-        msc_f_max = math.ceil(f_e_max)
-        builder.get_object('msc_f_max').set_text('{:.0f}'.format(msc_f_max))
-        builder.get_object('msc_fs_lvl').set_max_value(msc_f_max)
+    f_e = v['msc_fs']
+    print(f'f_e={f_e:.0f}')
+    # msc_f_max autoscale is a derived signal, see gui_publish
     txt = "{:.1f}".format(f_e)
     builder.get_object('msc_fs').set_text(txt)
     builder.get_object('msc_fs_lvl').set_value(f_e)
 
     # Status
-    status = d & 0x0f
+    global msc_status
+    status = msc_status = int(v['msc_state'])
     if status < len(running_states):
         builder.get_object('msc_state').set_text(running_states[status])
     else:
         builder.get_object('msc_state').set_text('???')
 
     # PLL good
-    builder.get_object('pll_good').set_active(d & (1 << 6))
-    builder.get_object('enc_inv').set_active(d & (1 << 5))
-    builder.get_object('enc_cal').set_active(d & (1 << 4))
+    builder.get_object('pll_good').set_active(bool(v['msc_pll_good']))
+    builder.get_object('enc_inv').set_active(bool(v['msc_enc_inv']))
+    builder.get_object('enc_cal').set_active(bool(v['msc_enc_cal']))
 
     # V imbalance
-    d = CANDataToUInt16(s[12:16])
-    x = d * 0.1
-    builder.get_object('msc_v_imbalance').set_text('{:.1f}'.format(x))
+    builder.get_object('msc_v_imbalance').set_text('{:.1f}'.format(v['msc_v_imbalance']))
 
 
-def msc_hs_temp(s: str) -> None:
-    if not len(s) == 4:
-        print(f'ERROR: msc_params_1: s={s} has not 4 chars')
-        return
-    txt = CANDataToString(s[0:4], 0.1, 1)
-    hs_temp = float(txt)
-    builder.get_object('msc_hs_temp').set_text(txt)
+def msc_hs_temp(v: dict) -> None:
+    hs_temp = v['msc_hs_temp']
+    builder.get_object('msc_hs_temp').set_text('{:.1f}'.format(hs_temp))
     builder.get_object('msc_hs_temp_lvl').set_value(hs_temp)
 
 
-def msc_params_1(s: str) -> None:
+def msc_params_1(v: dict) -> None:
     "Receive PMSM i_nom, v_nom, fs_min ans i_max."
     global msc_i_max, msc_v_nom
-    if not len(s) == 16:
-        print(f'ERROR: msc_params_1: s={s} has not 16 chars')
-        return
-    i_nom = CANDataToString(s[0:4], 0.1, 1)
-    builder.get_object("msc_i_nom").set_text(i_nom)
-    v_nom = CANDataToString(s[4:8], 0.1, 1)
-    msc_v_nom = float(v_nom)
+    builder_set(v['msc_i_nom'], 'msc_i_nom', 1)
+    msc_v_nom = v['msc_v_nom']
     builder.get_object("msc_v_nom").set_text('{:.1f}'.format(msc_v_nom))
-    f_min = CANDataToString(s[8:12], 0.1, 1)
-    builder.get_object('msc_f_min').set_text(f_min)
-    i_max = CANDataToString(s[12:16], 0.1, 1)
-    msc_i_max = float(i_max)
-    builder.get_object('msc_i_max').set_text(i_max)
+    builder_set(v['msc_f_min'], 'msc_f_min', 1)
+    msc_i_max = v['msc_i_max']
+    builder_set(msc_i_max, 'msc_i_max', 1)
     # builder.get_object('im_i_max').set_text(i_max)
     builder.get_object('msc_pout_lvl').set_max_value(gsc_power_max * 0.001)
     builder.get_object('msc_pout_max').set_text('{:.0f}kW'.format(gsc_power_max * 0.001))
 
 
-def set_values_n_lvl(s: list[str], name: str, meas: str, k=1.0) -> None:
-    i = 0
+def set_values_n_lvl(v: dict, name: str, meas: str) -> None:
     for ph in ['a', 'b', 'c']:
-        x = CANDataToInt16(s[i]) * k
+        x = v[name + ph + '_' + meas]
         builder.get_object(name + ph + '_' + meas).set_text('{:.1f}'.format(x))
         # builder.get_object(name + ph + '_' + meas + '_lvl').set_value(x)
-        i += 1
 
 
-def msc_meas_1(s: str) -> None:
+def msc_meas_1(v: dict) -> None:
     "Receive ia, ib and ic RMS and estimated Tel."
     # print('msc_meas_1')
-    set_values_n_lvl([s[0:4], s[4:8], s[8:12]], 'i', 'rms', 0.1)
+    set_values_n_lvl(v, 'i', 'rms')
     # Estimated Tel
-    x = CANDataToUInt16(s[12:16]) * 0.1
+    x = v['msc_tel']
     builder.get_object('msc_tel').set_text('{:.0f}N.m'.format(x))
     builder.get_object('msc_tel_lvl').set_value(x)
 
 
-def msc_meas_2(s: str) -> None:
+def msc_meas_2(v: dict) -> None:
     "Receive ia, ib, ic average and encoder."
-    set_values_n_lvl([s[0:4], s[4:8], s[8:12]], 'i', 'avg', 0.1)
+    set_values_n_lvl(v, 'i', 'avg')
     # Encoder
-    x = CANDataToUInt16(s[12:16])
+    x = int(v['msc_enc'])
     builder.get_object('msc_enc').set_text('{:d}'.format(x))
     builder.get_object('msc_enc_lvl').set_value(x)
 
 
-def msc_meas_3(s: str) -> None:
+def msc_meas_3(v: dict) -> None:
     "Receive va, vb and vc RMS."
-    set_values_n_lvl([s[0:4], s[4:8], s[8:12]], 'v', 'rms', 0.1)
-    rpm = CANDataToInt16(s[12:16])
-    builder.get_object('msc_rpm').set_text('{:d}'.format(rpm))
+    set_values_n_lvl(v, 'v', 'rms')
+    builder.get_object('msc_rpm').set_text('{:d}'.format(int(v['msc_rpm'])))
 
 
-def msc_meas_4(s: str) -> None:
+def msc_meas_4(v: dict) -> None:
     "Receive ia, ib and ic average."
-    set_values_n_lvl([s[0:4], s[4:8], s[8:12]], 'v', 'avg', 0.1)
+    set_values_n_lvl(v, 'v', 'avg')
 
 
-def msc_adc_a(s: str) -> None:
-    builder_set(s[0:4], 'msc_adc_a1')
-    builder_set(s[4:8], 'msc_adc_a2')
-    builder_set(s[8:12], 'msc_adc_a3')
-    builder_set(s[12:16], 'msc_adc_a4')
+def msc_adc_a(v: dict) -> None:
+    set_labels(v)
     # copies
-    # builder_set(s[0:4], "msc_adc_a1_")
-    # builder_set(s[4:8], "msc_adc_a2_")
-    # builder_set(s[8:12], "msc_adc_a3_")
-    # builder_set(s[12:16], "msc_adc_a4_")
+    # builder_set(v['msc_adc_a1'], "msc_adc_a1_")
 
 
-def msc_adc_b(s: str) -> None:
-    builder_set(s[0:4], 'msc_adc_b14')
-    builder_set(s[4:8], 'msc_adc_b2')
-    builder_set(s[8:12], 'msc_adc_b3')
-    builder_set(s[12:16], 'msc_adc_b4')
+def msc_adc_b(v: dict) -> None:
+    set_labels(v)
 
 
-def msc_adc_c(s: str) -> None:
-    builder_set(s[0:4], 'msc_adc_c14')
-    builder_set(s[4:8], 'msc_adc_c2')
-    builder_set(s[8:12], 'msc_adc_c3')
-    builder_set(s[12:16], 'msc_adc_c4')
+def msc_adc_c(v: dict) -> None:
+    set_labels(v)
     # copies
-    # builder_set(s[4:8], 'msc_adc_c2_')
-    # builder_set(s[12:16], 'msc_adc_c4_')
+    # builder_set(v['msc_adc_c2'], 'msc_adc_c2_')
 
 
-def msc_offset_1(s):
-    builder_set(s[0:4], 'e_ab_off', k=0.1, n_dec=1)
-    builder_set(s[4:8], 'e_bc_off', k=0.1, n_dec=1)
-    builder_set(s[8:12], 'e_ca_off', k=0.1, n_dec=1)
-    builder_set(s[12:16], 'msc_vbus_off', k=0.1, n_dec=1)
+def msc_offset_1(v: dict) -> None:
+    set_labels(v, 1)
 
 
-def msc_offset_2(s):
-    builder_set(s[0:4], 'i_a_off', k=0.1, n_dec=1)
-    builder_set(s[4:8], 'i_b_off', k=0.1, n_dec=1)
-    builder_set(s[8:12], 'i_c_off', k=0.1, n_dec=1)
-    theta_off = CANDataToUInt16(s[12:16]) * 0.1 * 180 / math.pi
-    builder.get_object('theta_off').set_text('{:.1f}°'.format(theta_off))
+def msc_offset_2(v: dict) -> None:
+    for name in ['i_a_off', 'i_b_off', 'i_c_off']:
+        builder_set(v[name], name, 1)
+    builder.get_object('theta_off').set_text('{:.1f}°'.format(v['theta_off']))
 
 
 can_ids = [
@@ -676,24 +641,87 @@ can_ids = [
 ]
 
 
+handlers = {row[0]: row[1] for row in can_ids}
+
+
+# Derived signals shown in GUI: format of labels with the same name
+derived_formats = {
+    'gsc_s_total': '{:.1f}',
+    'gsc_il_imbalance': '{:.1f}',
+    'gsc_vg_imbalance': '{:.1f}',
+    'msc_i_imbalance': '{:.1f}',
+    'msc_speed': '{:.1f}',
+    'msc_pmech': '{:.1f}',
+    'efficiency': '{:.1f}',
+}
+
+
+def gui_publish(values: dict, derived: dict, _ts: int) -> None:
+    """Show derived signals in GUI."""
+    global msc_f_max
+    if 'msc_f_max' in derived:
+        msc_f_max = derived['msc_f_max']
+        builder.get_object('msc_f_max').set_text('{:.0f}'.format(msc_f_max))
+        builder.get_object('msc_fs_lvl').set_max_value(msc_f_max)
+    for name, x in derived.items():
+        fmt = derived_formats.get(name)
+        if fmt is None:
+            continue
+        wdg = builder.get_object(name)
+        if wdg is not None:
+            wdg.set_text(fmt.format(x))
+
+
+def print_harmonics(_values: dict, derived: dict, _ts: int) -> None:
+    """Print harmonic analysis results, the GUI has no widgets for them."""
+    for name in analyzer.channels:
+        thd = derived.get(name + '_thd')
+        if thd is None:
+            continue
+        hs = ' '.join('{:.1f}'.format(derived[key]) for key in
+                      ('{}_h{}'.format(name, h) for h in range(2, analyzer.n_harmonics + 1)) if key in derived)
+        print('HARM {}: f1 {:.2f}Hz fund {:.1f} THD {:.2f}% h2.. {}%'.format(
+            name, derived[name + '_f1'], derived[name + '_fund'], thd, hs))
+
+
+# Consumers of decoded and derived signals: f(values, derived, ts)
+sinks = [gui_publish]
+
+
 def get_twai_data(lst) -> None:
     """
-    Parse data of each CAN id.
+    Decode data of each CAN id once, show it and feed the signal sinks.
     """
     if len(lst) < 2:
         print('WARN: get_twai_data has lst with less than 2 elements.')
         return
-    s = lst[1]
-    while len(s) < 8:
-        s = '0' + s
-    # print(f's={s}')
-    can_id = struct.unpack("!I", bytes.fromhex(s))[0]
-    for row in can_ids:
-        if can_id == row[0]:
-            if len(lst) == 3:
-                row[1](lst[2].strip())
-            # else:
-            #     print(f'WARNING: can id={hex(can_id)} has not data')
+    try:
+        can_id = int(lst[1], 16)
+    except ValueError:
+        print(f'ERROR: get_twai_data: bad CAN id {lst[1]}')
+        return
+    if len(lst) != 3 or can_id not in sig.SIGNALS:
+        # print(f'WARNING: can id={hex(can_id)} has not data')
+        return
+    data = lst[2].strip()
+    try:
+        values = sig.decode(can_id, data)
+    except ValueError:
+        print(f'ERROR: get_twai_data: can id={hex(can_id)} bad data {data}')
+        return
+    handler = handlers.get(can_id)
+    if handler is not None:
+        if len(values) < len(sig.SIGNALS[can_id]):
+            print(f'ERROR: {handler.__name__}: s={data} is too short')
+        else:
+            handler(values)
+    if param_key and can_id in paramcache.PARAM_IDS:
+        param_cache.put(param_key, can_id, data)
+    derived = engine.update(values)
+    if analyzer is not None:
+        derived.update(analyzer.add(values, frame_ts))
+    for sink in sinks:
+        sink(values, derived, frame_ts)
 
 
 callbacks = [['version', set_version],
@@ -701,19 +729,122 @@ callbacks = [['version', set_version],
              ]
 
 
-def interpret(lst: list[str]) -> None:
-    """Interpret commands from serial device."""
+def dispatch(func, lst, ts: int) -> None:
+    """Call func(lst) for a line received at ts (monotonic ns)."""
+    global frame_ts
+    frame_ts = ts
+    func(lst)
+
+
+def profiled_call(func, lst, ts: int, t_queued: int) -> None:
+    """Dispatch from GLib idle accounting queue delay and handler time."""
+    t0 = time.perf_counter_ns()
+    dispatch(func, lst, ts)
+    t1 = time.perf_counter_ns()
+    key = None
+    if lst[0] == 'twai' and len(lst) > 1:
+        try:
+            key = '0x{:04x}'.format(int(lst[1], 16))
+        except ValueError:
+            pass
+    prof.add_frame(key, t0 - t_queued, t1 - t0)
+
+
+def interpret(lst: list[str], ts: int, _rx_ts: int) -> None:
+    """Interpret commands from serial device, stamped ts (monotonic ns)."""
     for pair in callbacks:
         if lst[0] == pair[0]:
-            GLib.idle_add(pair[1], lst)
-
+            if prof is None:
+                GLib.idle_add(dispatch, pair[1], lst, ts)
+            else:
+                GLib.idle_add(profiled_call, pair[1], lst, ts, time.perf_counter_ns())
+
+
+def poll_worker() -> bool:
+    """Consume frames published by the serial worker process."""
+    for ts, rx_ts, lst in myser.poll():
+        for pair in callbacks:
+            if lst[0] == pair[0]:
+                # a failing frame must not remove this source, as it would
+                # stop the GUI updating for good
+                try:
+                    if prof is None:
+                        dispatch(pair[1], lst, ts)
+                    else:
+                        # reception time is monotonic, convert it to the perf_counter clock
+                        t_queued = time.perf_counter_ns() - (time.monotonic_ns() - rx_ts)
+                        profiled_call(pair[1], lst, ts, t_queued)
+                except Exception:  # pylint: disable=W0703
+                    traceback.print_exc()
+    return True
+
+
+def dump_profile(*_) -> bool:
+    """Print GUI and worker profile reports."""
+    prof.dump()
+    if not args.threaded:
+        myser.dump_profile()
+    return True
+
+
+parser = argparse.ArgumentParser(description='Supervisory for GSC and MSC by means of a ESP32.')
+parser.add_argument('--profile', action='store_true',
+                    help='time each pipeline stage; report on exit or on SIGUSR1')
+parser.add_argument('--threaded', action='store_true',
+                    help='read serial in a thread of the GUI process instead of a worker process')
+parser.add_argument('--setpoints', metavar='FILE', default='',
+                    help='run the timed setpoint profile FILE (JSON) once connected')
+parser.add_argument('--ack', metavar='WINDOW', type=int, default=0,
+                    help='number commands and wait gateway acknowledges, up to WINDOW in flight')
+parser.add_argument('--max-baud', metavar='BAUD', type=int, default=0,
+                    help='negotiate the highest baud rate up to BAUD when connecting')
+parser.add_argument('--harmonics', action='store_true',
+                    help='harmonic and THD analysis of GSC phases from ADC raw frames, printed and'
+                    ' published to --live-table/--export (needs numpy, runs in the GUI thread)')
+parser.add_argument('--live-table', metavar='FILE', nargs='?', const=livetable.DEFAULT_PATH, default='',
+                    help='publish live values in a memory mapped table (default %(const)s)')
+parser.add_argument('--export', metavar='PORT', type=int, default=0,
+                    help='serve /metrics over HTTP on PORT and a JSON push stream on PORT+1')
+parser.add_argument('--export-host', metavar='HOST', default='127.0.0.1',
+                    help='address for --export (default %(default)s, 0.0.0.0 for LAN)')
+parser.add_argument('--archive', metavar='DIR', default='',
+                    help='record every frame into a rotating compressed archive in DIR')
+args = parser.parse_args()
+
+prof = None
+engine = default_engine(msc_f_max)
+analyzer = None
+if args.harmonics:
+    from harmonics import HarmonicAnalyzer  # pylint: disable=C0413
+    analyzer = HarmonicAnalyzer(f_nom=gsc_fgrid_nom)
+    sinks.append(print_harmonics)
+live_table = None
+if args.live_table:
+    live_table = livetable.LiveTableWriter(sig.SIGNAL_NAMES + list(engine.defs) +
+                                           (analyzer.signal_names() if analyzer is not None else []),
+                                           args.live_table)
+    sinks.append(live_table.publish)
+if args.threaded:
+    myser = CanSerial(interpret)
+    if args.archive:
+        myser.recorder = ArchiveWriter(args.archive)
+    if args.ack:
+        myser.enable_ack(args.ack)
+    myser.max_baud = args.max_baud
+else:
+    # before creating any thread: the worker is forked
+    myser = SerialProcess(args.profile, args.archive, args.ack, args.max_baud)
+myser.debug = False  # remove this to operate
+# sinks starting threads go after the worker is forked
+exporter = None
+if args.export:
+    exporter = Exporter(args.export_host, args.export)
+    sinks.append(exporter.publish)
+myser.create_list()
 
 builder = Gtk.Builder()
 builder.add_from_file("superv.glade")
 
-myser = CanSerial(interpret)
-myser.debug = False  # remove this to operate
-myser.create_list()
 serial_combo = builder.get_object('serial_device')
 serial_combo.remove_all()
 for nn in myser.dev_list:
@@ -724,10 +855,22 @@ builder.connect_signals(Handler(builder))
 window = builder.get_object('window1')
 window.show_all()
 
+if args.profile:
+    prof = Profiler({'0x{:04x}'.format(row[0]): row[2] for row in can_ids})
+    if args.threaded:
+        myser.profiler = prof
+    # frame handlers use the global builder: account their GTK calls
+    builder = ProfiledBuilder(builder, prof)
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, dump_profile)
+    print('INFO: profiling enabled, send SIGUSR1 for a report')
+
 # Threads go here
-r_th = Thread(target=myser.read_thread)
-r_th.daemon = True
-r_th.start()
+if args.threaded:
+    r_th = Thread(target=myser.read_thread)
+    r_th.daemon = True
+    r_th.start()
+else:
+    GLib.timeout_add(20, poll_worker)
 
 
 def write_thread():
@@ -735,7 +878,7 @@ def write_thread():
     i: int = 0
     while True:
         i += 1
-        if not myser.ser.isOpen():
+        if not myser.is_open():
             time.sleep(2)
             continue
         if i == 1:
@@ -756,3 +899,17 @@ w_th.daemon = True
 w_th.start()
 
 Gtk.main()
+
+if prof is not None:
+    prof.dump()
+if not args.threaded:
+    # the worker prints its own profile and closes the archive when quitting
+    myser.close()
+elif myser.recorder is not None:
+    myser.running = False
+    r_th.join(1.5)
+    myser.recorder.close()
+if live_table is not None:
+    live_table.close()
+if exporter is not None:
+    exporter.close()
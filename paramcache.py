@@ -0,0 +1,69 @@
+"""
+Disk cache of parameter and offset frames, keyed by the version line the
+gateway reports, so they can be applied as soon as it is received and
+revalidated later.
+The key identifies a gateway only as far as its version line does (firmware
+version, and a board id if the firmware reports one): a different converter
+pair behind a gateway with the same version line gets the cached values of
+its predecessor until they are revalidated by the parameter requests.
+"""
+
+# pylint: disable=C0103
+
+import json
+import os
+from pathlib import Path
+import twai_ids as ids
+
+PARAM_IDS = [ids.GSCID_PARAMS_1, ids.GSCID_PARAMS_2, ids.GSCID_OFF_1, ids.GSCID_OFF_2,
+             ids.MSCID_PARAMS_1, ids.MSCID_OFF_1, ids.MSCID_OFF_2]
+
+
+def default_path() -> Path:
+    """Return cache file path following XDG."""
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'abv_superv' / 'params.json'
+
+
+def cache_key(version: list[str]) -> str:
+    """Return key of a gateway from the words of its version line."""
+    return ' '.join(version)
+
+
+class ParamCache:
+    """{key: {can id: data}} stored as JSON."""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else default_path()
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f'WARN: ignoring parameter cache {self.path}: {e}')
+
+    def get(self, key: str) -> dict:
+        """Return {can_id: data} cached for key."""
+        return {int(k, 16): v for k, v in self.entries.get(key, {}).items()}
+
+    def put(self, key: str, can_id: int, data: str) -> None:
+        """Store frame data of can_id for key, saving if it changed."""
+        entry = self.entries.setdefault(key, {})
+        k = '{:04x}'.format(can_id)
+        if entry.get(k) == data:
+            return
+        entry[k] = data
+        self.save()
+
+    def save(self) -> None:
+        """Write cache atomically."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f'WARN: saving parameter cache {self.path}: {e}')
@@ -0,0 +1,177 @@
+"""
+Opt-in pipeline profiler.
+Each frame is timestamped with perf_counter_ns at every stage (wait for
+data, readline, decode, GLib queue, handler unpack, GTK set) and the durations are kept in
+log2 histograms, so recording a sample is a couple of integer operations.
+"""
+
+# pylint: disable=C0103
+
+import time
+from threading import Lock
+
+N_BUCKETS = 48  # 2**47 ns is about 39 hours, far more than any stage takes
+
+STAGES = ['wait', 'readline', 'decode', 'queue', 'unpack', 'gtk', 'handler']
+
+
+class Histogram:
+    """
+    Power of two histogram of durations in nanoseconds.
+    Bucket i holds samples d with 2**(i-1) <= d < 2**i.
+    """
+
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.buckets = [0] * N_BUCKETS
+
+    def add(self, d: int) -> None:
+        """Add sample d in ns."""
+        if d < 0:
+            d = 0
+        if self.count == 0 or d < self.min:
+            self.min = d
+        if d > self.max:
+            self.max = d
+        self.count += 1
+        self.total += d
+        self.buckets[min(d.bit_length(), N_BUCKETS - 1)] += 1
+
+    def percentile(self, p: float) -> int:
+        """Return upper bound in ns of bucket holding percentile p (0..100)."""
+        if self.count == 0:
+            return 0
+        target = self.count * p / 100.0
+        acc = 0
+        for i, n in enumerate(self.buckets):
+            acc += n
+            if acc >= target:
+                return min(1 << i, self.max)
+        return self.max
+
+    def mean(self) -> float:
+        """Mean value in ns."""
+        return self.total / self.count if self.count else 0.0
+
+
+def fmt_ns(d: float) -> str:
+    """Format a duration in ns with a convenient unit."""
+    if d >= 1e6:
+        return '{:.2f}ms'.format(d * 1e-6)
+    if d >= 1e3:
+        return '{:.1f}us'.format(d * 1e-3)
+    return '{:.0f}ns'.format(d)
+
+
+class Profiler:
+    """
+    Collect per stage and per CAN id histograms.
+    Callers keep a reference to None when profiling is disabled, so the only
+    cost in that case is an `is not None` test.
+    """
+
+    def __init__(self, names=None):
+        self.mut = Lock()
+        self.stages = {st: Histogram() for st in STAGES}
+        self.by_id = {}
+        self.names = names if names is not None else {}
+        self.gtk_acc = 0  # ns spent in GTK calls by the running handler
+        self.t_start = time.perf_counter_ns()
+
+    def add(self, stage: str, d: int) -> None:
+        """Add sample d (ns) to stage."""
+        with self.mut:
+            self.stages[stage].add(d)
+
+    def add_frame(self, key, d_queue: int, d_handler: int) -> None:
+        """Add the GUI side samples of one frame, identified by key."""
+        d_gtk = self.gtk_acc
+        self.gtk_acc = 0
+        with self.mut:
+            self.stages['queue'].add(d_queue)
+            self.stages['handler'].add(d_handler)
+            self.stages['gtk'].add(d_gtk)
+            self.stages['unpack'].add(d_handler - d_gtk)
+            if key is not None:
+                h = self.by_id.get(key)
+                if h is None:
+                    h = self.by_id[key] = Histogram()
+                h.add(d_handler)
+
+    def reset(self) -> None:
+        """Clear all histograms."""
+        with self.mut:
+            self.stages = {st: Histogram() for st in STAGES}
+            self.by_id = {}
+            self.t_start = time.perf_counter_ns()
+
+    def report(self) -> str:
+        """Return a text report of all histograms."""
+        elapsed = (time.perf_counter_ns() - self.t_start) * 1e-9
+        hdr = '{:<28} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            '', 'count', 'mean', 'p50', 'p99', 'max', 'total')
+        lines = ['PROFILE: {:.1f}s elapsed'.format(elapsed), hdr]
+
+        def row(name, h):
+            return '{:<28} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+                name[:28], h.count, fmt_ns(h.mean()), fmt_ns(h.percentile(50)),
+                fmt_ns(h.percentile(99)), fmt_ns(h.max), fmt_ns(h.total))
+
+        with self.mut:
+            for st in STAGES:
+                lines.append(row(st, self.stages[st]))
+            lines.append('per CAN id (handler):')
+            for key in sorted(self.by_id, key=str):
+                name = '{} {}'.format(key, self.names.get(key, ''))
+                lines.append(row(name, self.by_id[key]))
+        return '\n'.join(lines)
+
+    def dump(self, *_) -> bool:
+        """Print report, suitable as GLib signal/timeout callback."""
+        print(self.report())
+        return True
+
+
+class ProfiledWidget:
+    """Proxy for a GTK widget that accounts time of its method calls."""
+
+    def __init__(self, wdg, prof: Profiler):
+        self._wdg = wdg
+        self._prof = prof
+
+    def __getattr__(self, name):
+        attr = getattr(self._wdg, name)
+        if not callable(attr):
+            return attr
+        prof = self._prof
+
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter_ns()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                prof.gtk_acc += time.perf_counter_ns() - t0
+        return timed
+
+
+class ProfiledBuilder:
+    """Proxy for Gtk.Builder returning profiled widgets."""
+
+    def __init__(self, builder, prof: Profiler):
+        self._builder = builder
+        self._prof = prof
+
+    def get_object(self, name):
+        """Return profiled widget, None if there is none; lookup itself is accounted as GTK time."""
+        t0 = time.perf_counter_ns()
+        wdg = self._builder.get_object(name)
+        self._prof.gtk_acc += time.perf_counter_ns() - t0
+        return ProfiledWidget(wdg, self._prof) if wdg is not None else None
+
+    def __getattr__(self, name):
+        return getattr(self._builder, name)
@@ -0,0 +1,94 @@
+"""
+Single producer, single consumer frame ring in shared memory.
+The producer (serial worker process) never blocks: when the GUI falls behind
+the oldest frames are overwritten and the consumer counts them as lost.
+"""
+
+# pylint: disable=C0103
+
+import struct
+import time
+from multiprocessing import shared_memory
+
+SLOT_SIZE = 128
+SLOT_HDR = struct.Struct('<QQQH')  # slot sequence, monotonic ns timestamp, reception monotonic ns, length
+SLOT_DATA = SLOT_SIZE - SLOT_HDR.size
+RING_HDR = struct.Struct('<QI')  # write sequence, capacity
+RING_HDR_SIZE = 64  # keep header and slots on different cache lines
+SEQ = struct.Struct('<Q')
+
+
+class FrameRing:
+    """
+    Ring of text frames with a timestamp.
+    Slot n holds frame number n (counted from 1); its sequence field is zeroed
+    while it is being written, which the consumer uses to detect torn reads.
+    """
+
+    def __init__(self, capacity=4096, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=RING_HDR_SIZE + capacity * SLOT_SIZE)
+            self.owner = True
+            RING_HDR.pack_into(self.shm.buf, 0, 0, capacity)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.capacity = RING_HDR.unpack_from(self.shm.buf, 0)[1]
+        self.buf = self.shm.buf
+        self.w_seq = SEQ.unpack_from(self.buf, 0)[0]  # producer side
+        self.r_seq = self.w_seq  # consumer side: next frame to read
+        self.lost = 0
+        self.truncated = 0
+
+    @property
+    def name(self) -> str:
+        """Shared memory name, to attach from another process."""
+        return self.shm.name
+
+    def put(self, data: bytes, ts: int = 0, rx_ts: int = 0) -> None:
+        """Publish a frame stamped ts (gateway aligned) and received at rx_ts (producer only)."""
+        if len(data) > SLOT_DATA:
+            data = data[:SLOT_DATA]
+            self.truncated += 1
+        if ts == 0:
+            ts = time.monotonic_ns()
+        if rx_ts == 0:
+            rx_ts = ts
+        n = self.w_seq + 1
+        off = RING_HDR_SIZE + (n % self.capacity) * SLOT_SIZE
+        buf = self.buf
+        SEQ.pack_into(buf, off, 0)
+        buf[off + SLOT_HDR.size:off + SLOT_HDR.size + len(data)] = data
+        SLOT_HDR.pack_into(buf, off, n, ts, rx_ts, len(data))
+        SEQ.pack_into(buf, 0, n)
+        self.w_seq = n
+
+    def get(self, max_frames=256) -> list:
+        """Return up to max_frames [(ts, rx_ts, data)] not yet read (consumer only)."""
+        buf = self.buf
+        w_seq = SEQ.unpack_from(buf, 0)[0]
+        if w_seq - self.r_seq > self.capacity - 1:
+            # lapped by the producer: skip to the oldest frame surely intact
+            skip = w_seq - (self.capacity - 1) - self.r_seq
+            self.lost += skip
+            self.r_seq += skip
+        frames = []
+        while self.r_seq < w_seq and len(frames) < max_frames:
+            n = self.r_seq + 1
+            off = RING_HDR_SIZE + (n % self.capacity) * SLOT_SIZE
+            seq, ts, rx_ts, length = SLOT_HDR.unpack_from(buf, off)
+            data = bytes(buf[off + SLOT_HDR.size:off + SLOT_HDR.size + length])
+            if seq != n or SEQ.unpack_from(buf, off)[0] != n:
+                # overwritten while reading
+                self.lost += 1
+            else:
+                frames.append((ts, rx_ts, data))
+            self.r_seq = n
+        return frames
+
+    def close(self) -> None:
+        """Release shared memory; the creator also removes it."""
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
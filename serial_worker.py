@@ -0,0 +1,161 @@
+"""
+Serial reader, decoder and writer running in a separate process.
+Decoded lines are published into a shared memory FrameRing, so the GUI
+consumes them at its own pace and GTK redraws never starve serial reading.
+Commands go the other way through a multiprocessing queue.
+"""
+
+# pylint: disable=C0103
+
+import multiprocessing
+import queue
+import time
+from threading import Thread
+import serial
+from archive import ArchiveWriter
+from canserial import CanSerial
+from profiler import Profiler
+from ring import FrameRing
+
+STOP_TIMEOUT = 1.5  # s to wait for the reader thread when quitting
+OPEN_TIMEOUT = 20.0  # s to wait for the worker to report an open result, above linkprobe.NEGOTIATE_TIME
+
+
+def worker_main(ring: FrameRing, cmd_q, evt_q, profile: bool, archive: str, ack: int, max_baud: int) -> None:
+    """Worker process: own the serial port, record frames and execute GUI commands."""
+    def publish(lst, ts, rx_ts):
+        ring.put(' '.join(lst).encode('utf-8'), ts, rx_ts)
+
+    ser = CanSerial(publish)
+    if profile:
+        ser.profiler = Profiler()
+    if archive:
+        ser.recorder = ArchiveWriter(archive)
+    if ack:
+        ser.enable_ack(ack)
+    ser.max_baud = max_baud
+    r_th = Thread(target=ser.read_thread)
+    r_th.daemon = True
+    r_th.start()
+    while True:
+        cmd = cmd_q.get()
+        if cmd[0] == 'write':
+            ser.write(cmd[1])
+        elif cmd[0] == 'open':
+            try:
+                ser.open(cmd[1])
+                evt_q.put(('open', cmd[2], ser.is_open(), ser.ser.baudrate, ser.throughput))
+            except serial.SerialException as e:
+                print(f'ERROR: opening serial {cmd[1]}: {e}')
+                evt_q.put(('open', cmd[2], False, 0, 0.0))
+        elif cmd[0] == 'disconnect':
+            ser.disconnect()
+        elif cmd[0] == 'reset':
+            ser.reset()
+        elif cmd[0] == 'profile':
+            if ser.profiler is not None:
+                print('WORKER ' + ser.profiler.report())
+        elif cmd[0] == 'quit':
+            if ser.profiler is not None:
+                print('WORKER ' + ser.profiler.report())
+            # stop recording before closing the archive, readline times out in 1s
+            ser.running = False
+            r_th.join(STOP_TIMEOUT)
+            ser.disconnect()
+            if ser.recorder is not None:
+                ser.recorder.close()
+            break
+        else:
+            print(f'ERROR: serial worker: unknown command {cmd}')
+
+
+class SerialProcess:
+    """
+    GUI side of the serial worker, with the CanSerial methods used by the GUI.
+    Frames are read with poll().
+    """
+
+    def __init__(self, profile=False, archive='', ack=0, max_baud=0, capacity=4096):
+        # fork: main.py runs the GUI at import time, so it can not be
+        # re-imported by a spawned child. Must start before any thread.
+        ctx = multiprocessing.get_context('fork')
+        self.ring = FrameRing(capacity)
+        self.cmd_q = ctx.Queue()
+        self.evt_q = ctx.Queue()
+        self.name = ''
+        self.opened = False
+        self.open_id = 0  # matches open replies to requests
+        self.baudrate = 0
+        self.throughput = 0.0
+        self.debug = False
+        self.dev_list = []
+        self.proc = ctx.Process(target=worker_main, name='serial_worker',
+                                args=(self.ring, self.cmd_q, self.evt_q, profile, archive, ack, max_baud))
+        self.proc.daemon = True
+        self.proc.start()
+
+    def create_list(self):
+        """Return a list of serial devices available."""
+        ser = CanSerial(None)
+        ser.create_list()
+        self.dev_list = ser.dev_list
+
+    def is_open(self) -> bool:
+        """Return True if the worker has the serial port open."""
+        return self.opened
+
+    def open(self, name_):
+        """Ask worker to open serial name_ and wait for the result."""
+        self.open_id += 1
+        self.cmd_q.put(('open', name_, self.open_id))
+        self.opened = False
+        deadline = time.monotonic() + OPEN_TIMEOUT
+        while True:
+            try:
+                evt = self.evt_q.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                print(f'ERROR: serial worker did not answer opening {name_}')
+                break
+            if evt[1] == self.open_id:
+                _, _, self.opened, self.baudrate, self.throughput = evt
+                break
+            # late answer of a previous request that timed out
+        self.name = name_ if self.opened else ''
+
+    def write(self, s: str):
+        """Queue command s to be written by the worker."""
+        if self.debug:
+            print(s)
+        if not self.opened:
+            print('ERROR: serial is not openned')
+            return
+        self.cmd_q.put(('write', s))
+
+    def reset(self):
+        """Reset ESP32 with Reset pin connected to DTR."""
+        self.cmd_q.put(('reset',))
+
+    def disconnect(self):
+        """Close serial in the worker."""
+        self.cmd_q.put(('disconnect',))
+        self.opened = False
+        self.name = ''
+
+    def poll(self, max_frames=256) -> list:
+        """Return [(ts, rx_ts, lst)] of frames published since last call."""
+        return [(ts, rx_ts, data.decode('utf-8').split(' '))
+                for ts, rx_ts, data in self.ring.get(max_frames)]
+
+    def dump_profile(self):
+        """Ask the worker to print its profile report."""
+        self.cmd_q.put(('profile',))
+
+    def close(self):
+        """Stop worker and release the ring."""
+        self.cmd_q.put(('quit',))
+        self.proc.join(STOP_TIMEOUT + 2.0)
+        if self.proc.is_alive():
+            self.proc.terminate()
+        if self.ring.lost:
+            print(f'WARN: {self.ring.lost} frames lost between worker and GUI')
+        self.ring.close()
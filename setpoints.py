@@ -0,0 +1,191 @@
+"""
+Timed setpoint profile runner.
+A profile is a JSON file with a sequence of steps:
+
+    {"period": 0.1,
+     "steps": [
+        {"target": "msc_i_ref", "type": "step", "value": 5.0},
+        {"type": "dwell", "time": 10.0},
+        {"target": "msc_i_ref", "type": "ramp", "value": 20.0, "time": 30.0},
+        {"target": "gsc_max_power", "type": "step", "value": 0.5},
+        {"target": "inv_da", "type": "ramp", "value": 40, "time": 5.0}
+     ]}
+
+Ramps are sent every period seconds, starting from the value of the
+previous step of their target, or from its current setpoint. Values out of
+the LIMITS of their target reject the profile. Steps are compiled into a schedule of
+(planned time, target, value) run from a thread on the monotonic clock:
+sleep until close to the deadline, then spin, so jitter is bounded by the
+spin margin instead of by the OS scheduler. Converter alarms are polled
+while waiting, so an alarm aborts the profile within ALARM_POLL even in a
+long dwell, until the end of the last step. Planned and write times of
+every command are logged to CSV; with the serial worker process the write
+time is when the command was queued to the worker, not when it reached the
+serial port.
+"""
+
+# pylint: disable=C0103
+
+import csv
+import json
+import time
+from threading import Thread, Event
+import commands
+
+SPIN = 2e-3  # s before a deadline where sleeping gives way to spinning
+ALARM_POLL = 0.02  # s between alarm checks while waiting
+PERIOD = 0.1  # s, default ramp command period
+
+
+def inv_da(da: float) -> list[str]:
+    """Tupã inverter duty, sent only while the inverter is active (as the GUI does)."""
+    return commands.inv(True, int(round(da)))
+
+
+TARGETS = {
+    'msc_i_ref': lambda x: [commands.msc_curr_ref(x)],
+    'gsc_max_power': lambda v: [commands.gsc_max_power(v)],
+    'inv_da': inv_da,
+}
+
+# (min, max) of each target, as the protocol and the GUI controls allow
+LIMITS = {
+    'msc_i_ref': (-50.0, 50.0),
+    'gsc_max_power': (0.0, 1.0),
+    'inv_da': (0, 127),
+}
+
+# commands sent when a profile is aborted
+SAFE = [('msc_i_ref', 0.0)]
+
+
+def compile_profile(profile: dict, initial=None, limits=None) -> list:
+    """
+    Return schedule [(t, target, value)] with t in s from profile start.
+    initial holds current setpoints {target: value} ramps start from,
+    limits overrides LIMITS; raise ValueError on invalid profiles.
+    """
+    period = profile.get('period', PERIOD)
+    limits = dict(LIMITS, **(limits or {}))
+    t = 0.0
+    last = dict(initial or {})  # last value of each target
+    schedule = []
+    for i, step in enumerate(profile['steps']):
+        kind = step.get('type', 'step')
+        if kind == 'dwell':
+            t += step['time']
+            continue
+        target = step['target']
+        if target not in TARGETS:
+            raise ValueError(f'step {i}: unknown target {target}')
+        value = float(step['value'])
+        lo, hi = limits[target]
+        if not lo <= value <= hi:
+            raise ValueError(f'step {i}: {target} {value} out of range [{lo}, {hi}]')
+        if kind == 'step':
+            schedule.append((t, target, value))
+        elif kind == 'ramp':
+            x0 = last.get(target, 0.0)
+            n = max(int(round(step['time'] / period)), 1)
+            for k in range(1, n + 1):
+                schedule.append((t + k * period, target, x0 + (value - x0) * k / n))
+            t += n * period
+        else:
+            raise ValueError(f'step {i}: unknown type {kind}')
+        last[target] = value
+    # end of profile, after a final dwell
+    schedule.append((t, None, None))
+    return schedule
+
+
+class ProfileRunner:
+    """
+    Run a compiled schedule sending commands with write.
+    alarm() is polled while waiting, a non empty return aborts.
+    inv_active() tells if the inverter is active: inv_da steps are skipped
+    while it is not, the profile never switches the inverter on.
+    """
+
+    def __init__(self, schedule, write, alarm, log_name: str, inv_active=None):
+        self.schedule = schedule
+        self.write = write
+        self.alarm = alarm
+        self.inv_active = inv_active if inv_active is not None else lambda: False
+        self.log_name = log_name
+        self.stop_evt = Event()
+        self.safe_stop = True
+        self.th = None
+
+    @classmethod
+    def from_file(cls, name: str, write, alarm, inv_active=None, initial=None, limits=None):
+        """Load profile from JSON file name, log next to it."""
+        with open(name) as f:
+            schedule = compile_profile(json.load(f), initial, limits)
+        log_name = name.rsplit('.', 1)[0] + time.strftime('-%Y%m%d-%H%M%S.csv')
+        return cls(schedule, write, alarm, log_name, inv_active)
+
+    def start(self):
+        """Run schedule in a new thread."""
+        self.stop_evt.clear()
+        self.th = Thread(target=self.run, name='setpoints')
+        self.th.daemon = True
+        self.th.start()
+
+    def stop(self, safe=True):
+        """Abort a running schedule, sending SAFE setpoints unless the operator took over."""
+        self.safe_stop = safe
+        self.stop_evt.set()
+
+    def wait_until(self, deadline: int) -> str:
+        """Wait monotonic deadline (ns); return why it was aborted, '' if reached."""
+        while True:
+            remaining = (deadline - time.monotonic_ns()) * 1e-9
+            if remaining <= 0:
+                return ''
+            if remaining > SPIN:
+                if self.stop_evt.wait(min(remaining - SPIN, ALARM_POLL)):
+                    return 'stopped'
+                reason = self.alarm()
+                if reason:
+                    return reason
+            elif self.stop_evt.is_set():
+                return 'stopped'
+
+    def abort(self, reason: str):
+        """Send safe setpoints."""
+        print(f'WARN: setpoint profile aborted: {reason}')
+        for target, value in SAFE:
+            for cmd in TARGETS[target](value):
+                self.write(cmd)
+
+    def run(self):
+        """Run schedule logging planned and write times."""
+        print(f'INFO: setpoint profile: {len(self.schedule) - 1} commands, log {self.log_name}')
+        max_err = 0
+        with open(self.log_name, 'w', newline='') as f:
+            log = csv.writer(f)
+            log.writerow(['planned_ns', 'write_ns', 'error_us', 'target', 'value', 'command'])
+            t0 = time.monotonic_ns() + int(SPIN * 1e9)
+            for t, target, value in self.schedule:
+                planned = t0 + int(t * 1e9)
+                reason = self.wait_until(planned) or self.alarm()
+                if reason == 'stopped' and not self.safe_stop:
+                    print('INFO: setpoint profile stopped by the operator')
+                    log.writerow([time.monotonic_ns() - t0, '', '', target, value, 'STOP: operator'])
+                    return
+                if reason:
+                    self.abort(reason)
+                    log.writerow([time.monotonic_ns() - t0, '', '', target, value, f'ABORT: {reason}'])
+                    return
+                if target is None:
+                    break
+                if target == 'inv_da' and not self.inv_active():
+                    log.writerow([planned - t0, '', '', target, value, 'SKIP: inverter not active'])
+                    continue
+                for cmd in TARGETS[target](value):
+                    actual = time.monotonic_ns()
+                    self.write(cmd)
+                    err = actual - planned
+                    max_err = max(max_err, abs(err))
+                    log.writerow([planned - t0, actual - t0, '{:.1f}'.format(err * 1e-3), target, value, cmd])
+        print('INFO: setpoint profile done, max timing error {:.1f}us'.format(max_err * 1e-3))
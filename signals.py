@@ -0,0 +1,101 @@
+"""
+Signal definitions of the CAN frames sent by GSC and MSC.
+Frames are decoded once with these definitions and the handlers of main.py
+display the values; kept free of GTK so that offline tools can decode
+recorded frames with the same definitions.
+"""
+
+# pylint: disable=C0103
+
+import math
+import struct
+from collections import namedtuple
+import twai_ids as ids
+
+RUNNING_STATES = ['INIT', 'OFFSET', 'PLL', 'ENC_CAL', 'READY', 'RUNNING', 'OVERHEAT', 'OPENPHASE', 'HIGH_VBUS', 'ENC_FAIL', 'DISCHARGE', 'I_IMBALANCE', 'V_IMBALANCE']
+
+# Field of a frame: byte offset, struct format (big endian), scale, and for
+# packed words the right shift and mask applied before scaling.
+Field = namedtuple('Field', ['name', 'offset', 'fmt', 'scale', 'shift', 'mask'],
+                   defaults=[1.0, 0, None])
+
+
+def words(names, fmt='h', scale=1.0) -> list:
+    """Return fields of consecutive 16 bit words."""
+    return [Field(n, 2 * i, fmt, scale) for i, n in enumerate(names)]
+
+
+SIGNALS = {
+    # From GSC:
+    ids.GSCID_VBUS_N_STATUS: [Field('gsc_vbus', 0, 'H', 0.1),
+                              Field('gsc_power', 2, 'H', 0.1),
+                              Field('gsc_state', 4, 'B')],
+    ids.GSCID_HS_TEMP: [Field('gsc_hs_temp', 0, 'h', 0.1)],
+    ids.GSCID_PARAMS_1: words(['gsc_i_max', 'gsc_i_min', 'gsc_f_nom']),
+    ids.GSCID_PARAMS_2: words(['gsc_vbus_max', 'gsc_vbus_target_max', 'gsc_vbus_target_min', 'gsc_vbus_min'], 'H'),
+    ids.GSCID_MEAS_1: words(['ila_rms', 'ilb_rms', 'ilc_rms'], 'h', 0.1) + [Field('gsc_i_imbalance', 6, 'h')],
+    ids.GSCID_MEAS_2: words(['ila_avg', 'ilb_avg', 'ilc_avg'], 'h', 0.1),
+    ids.GSCID_MEAS_3: words(['vga_rms', 'vgb_rms', 'vgc_rms'], 'h', 0.1) + [Field('gsc_v_imbalance', 6, 'h')],
+    ids.GSCID_MEAS_4: words(['vga_avg', 'vgb_avg', 'vgc_avg'], 'h', 0.1),
+    ids.GSCID_ADCA: words(['gsc_adc_a1', 'gsc_adc_a2', 'gsc_adc_a3', 'gsc_adc_a4']),
+    ids.GSCID_ADCB: words(['gsc_adc_b14', 'gsc_adc_b2', 'gsc_adc_b3', 'gsc_adc_b4']),
+    ids.GSCID_ADCC: words(['gsc_adc_c14', 'gsc_adc_c2', 'gsc_adc_c3', 'gsc_adc_c4']),
+    ids.GSCID_OFF_1: words(['vga_off', 'vgb_off', 'vgc_off', 'gsc_vbus_off'], 'h', 0.1),
+    ids.GSCID_OFF_2: words(['ila_off', 'ilb_off', 'ilc_off'], 'h', 0.1),
+    # From MSC:
+    ids.MSCID_VBUS_N_STATUS: [Field('msc_vbus', 0, 'H', 0.1),
+                              Field('msc_pout', 2, 'H', 0.1),
+                              Field('msc_fs', 4, 'H', 1.0, 7),
+                              Field('msc_state', 4, 'H', 1.0, 0, 0x0f),
+                              Field('msc_pll_good', 4, 'H', 1.0, 6, 1),
+                              Field('msc_enc_inv', 4, 'H', 1.0, 5, 1),
+                              Field('msc_enc_cal', 4, 'H', 1.0, 4, 1),
+                              Field('msc_v_imbalance', 6, 'H', 0.1)],
+    ids.MSCID_HS_TEMP: [Field('msc_hs_temp', 0, 'H', 0.1)],
+    ids.MSCID_PARAMS_1: words(['msc_i_nom', 'msc_v_nom', 'msc_f_min', 'msc_i_max'], 'H', 0.1),
+    ids.MSCID_MEAS_1: words(['ia_rms', 'ib_rms', 'ic_rms'], 'h', 0.1) + [Field('msc_tel', 6, 'H', 0.1)],
+    ids.MSCID_MEAS_2: words(['ia_avg', 'ib_avg', 'ic_avg'], 'h', 0.1) + [Field('msc_enc', 6, 'H')],
+    ids.MSCID_MEAS_3: words(['va_rms', 'vb_rms', 'vc_rms'], 'h', 0.1) + [Field('msc_rpm', 6, 'h')],
+    ids.MSCID_MEAS_4: words(['va_avg', 'vb_avg', 'vc_avg'], 'h', 0.1),
+    ids.MSCID_ADCA: words(['msc_adc_a1', 'msc_adc_a2', 'msc_adc_a3', 'msc_adc_a4']),
+    ids.MSCID_ADCB: words(['msc_adc_b14', 'msc_adc_b2', 'msc_adc_b3', 'msc_adc_b4']),
+    ids.MSCID_ADCC: words(['msc_adc_c14', 'msc_adc_c2', 'msc_adc_c3', 'msc_adc_c4']),
+    ids.MSCID_OFF_1: words(['e_ab_off', 'e_bc_off', 'e_ca_off', 'msc_vbus_off'], 'h', 0.1),
+    ids.MSCID_OFF_2: words(['i_a_off', 'i_b_off', 'i_c_off'], 'h', 0.1) + [Field('theta_off', 6, 'H', 0.1 * 180 / math.pi)],
+}
+
+SIGNAL_NAMES = [fld.name for fields in SIGNALS.values() for fld in fields]
+
+
+def field_size(fld: Field) -> int:
+    """Return size in bytes of field."""
+    return struct.calcsize(fld.fmt)
+
+
+def decode(can_id: int, data: str) -> dict:
+    """Return {name: value} of frame can_id with hex string data."""
+    fields = SIGNALS.get(can_id)
+    if fields is None:
+        return {}
+    raw = bytes.fromhex(data)
+    values = {}
+    for fld in fields:
+        if fld.offset + field_size(fld) > len(raw):
+            continue
+        x = struct.unpack_from('!' + fld.fmt, raw, fld.offset)[0] >> fld.shift
+        if fld.mask is not None:
+            x &= fld.mask
+        values[fld.name] = x * fld.scale
+    return values
+
+
+def parse_twai(lst: list[str]):
+    """Return (can_id, data) of a 'twai <id> <data> [@<tick>]' line split in lst, or None."""
+    if len(lst) == 4 and lst[3].startswith('@'):
+        lst = lst[:3]
+    if len(lst) != 3 or lst[0] != 'twai':
+        return None
+    try:
+        return int(lst[1], 16), lst[2].strip()
+    except ValueError:
+        return None
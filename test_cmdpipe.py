@@ -0,0 +1,99 @@
+"""Tests of superseded command detection in cmdpipe."""
+
+import time
+import unittest
+from cmdpipe import CommandPipe, command_key
+
+TIMEOUT = 0.05  # s, ack timeout of the pipes under test
+
+
+class FakeLink:
+    """Record lines written by a CommandPipe."""
+
+    def __init__(self):
+        self.sent = []
+
+    def write_raw(self, s: str) -> None:
+        self.sent.append(s)
+
+    def wait_sent(self, n: int, timeout=1.0) -> None:
+        """Wait until n lines were written."""
+        deadline = time.monotonic() + timeout
+        while len(self.sent) < n and time.monotonic() < deadline:
+            time.sleep(1e-3)
+
+
+class CommandKeyTest(unittest.TestCase):
+
+    def test_setpoints(self):
+        self.assertEqual(command_key('send 0205 00c8'), 'send 0205')
+        self.assertEqual(command_key('send 0105 01f4'), 'send 0105')
+
+    def test_inverter_pair_ignores_flag(self):
+        self.assertEqual(command_key('inv 1 20'), command_key('inv 0 20'))
+        self.assertEqual(command_key('send 1ffc0700 94'), command_key('send 1ffc0700 14'))
+
+    def test_requests_are_not_setpoints(self):
+        self.assertIsNone(command_key('send 0208 0001'))
+        self.assertIsNone(command_key('send 0208 003c'))
+        self.assertIsNone(command_key('send 0108 0300'))
+
+
+class SupersedeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.link = FakeLink()
+        self.pipe = CommandPipe(self.link.write_raw, timeout=TIMEOUT, retries=3)
+
+    def tearDown(self):
+        self.pipe.clear()
+
+    def test_lost_request_resent_after_poll(self):
+        # a lost params request is not dropped by the following meas poll
+        self.pipe.submit('send 0208 0001')
+        self.pipe.submit('send 0208 003c')
+        self.link.wait_sent(2)
+        self.pipe.on_ack(['ack', '0002'])
+        self.link.wait_sent(3)
+        self.assertEqual(self.link.sent[2], '@0001 send 0208 0001')
+        self.assertEqual(self.pipe.n_superseded, 0)
+
+    def test_inverter_off_not_undone(self):
+        # 'inv 1' unacknowledged must not be resent after 'inv 0' was acked
+        self.pipe.submit('inv 1 20')
+        self.link.wait_sent(1)
+        self.pipe.submit('inv 0 20')
+        self.link.wait_sent(2)
+        self.pipe.on_ack(['ack', '0002'])
+        time.sleep(4 * TIMEOUT)
+        self.assertEqual(self.link.sent, ['@0001 inv 1 20', '@0002 inv 0 20'])
+        self.assertEqual(self.pipe.n_superseded, 1)
+
+    def test_setpoint_superseded(self):
+        self.pipe.submit('send 0205 00c8')
+        self.link.wait_sent(1)
+        self.pipe.submit('send 0205 0000')
+        self.link.wait_sent(2)
+        self.pipe.on_ack(['ack', '0002'])
+        time.sleep(4 * TIMEOUT)
+        self.assertEqual(len(self.link.sent), 2)
+        self.assertEqual(self.pipe.n_superseded, 1)
+
+    def test_pending_setpoints_skipped(self):
+        # with the window full, stale queued setpoints are never sent
+        link = FakeLink()
+        pipe = CommandPipe(link.write_raw, window=1, timeout=1.0)
+        pipe.submit('send 0208 003c')
+        link.wait_sent(1)
+        for x in ['0064', '00c8', '012c', '0000']:
+            pipe.submit('send 0205 ' + x)
+        pipe.on_ack(['ack', '0001'])
+        link.wait_sent(2)
+        time.sleep(4 * TIMEOUT)
+        self.assertEqual(link.sent, ['@0001 send 0208 003c', '@0005 send 0205 0000'])
+        self.assertEqual(pipe.n_superseded, 3)
+        pipe.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()